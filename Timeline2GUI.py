@@ -5,30 +5,103 @@ Operations include upload, filter using field data and search for strings
 """
 import tkinter as tk
 from pandastable import Table
-import numpy as np
 import os
 import pandas as pd
-import shlex
 from tkinter import ttk
+import sys
+from workers import Task
+from engine import Timeline, read_configuration
+from storage import source_files
+from export import export_view, EXPORT_ROWS
+from instrument import Recorder
+
+#how often the UI checks on a background task, in milliseconds
+POLL_MS = 100;
+#how often a followed file is checked for new rows when tail_ms is not configured
+TAIL_MS = 2000;
 
 class MyTable(Table):
-    """Customized Table for sorting ascending and descending"""
-    def __init__(self, frame, data):
-        super().__init__(parent=frame, dataframe=data, index=False, replace=False, \
+    """Customized Table showing a TableView one page at a time, for sorting ascending and descending"""
+    def __init__(self, frame, view, page_rows=0, recorder=None):
+        self.view = view;
+        #page drawing is timed as the draw stage
+        self.recorder = recorder or Recorder();
+        self.show_all = page_rows <= 0;
+        self.page_rows = page_rows if page_rows > 0 else max(len(view), 1);
+        self.page_start = 0;
+        self.pager = None;
+        super().__init__(parent=frame, dataframe=view.window(0, self.page_rows), index=False, replace=False, \
               showtoolbar=False, showstatusbar=False, showindex=True, 
               thefont=("Calibri", 12));
         self.ascending = 1;
 
+    def show(self, callback=None):
+        Table.show(self, callback);
+        self.show_page(0);
+
+    def show_page(self, start):
+        """Fetches only the rows start:start + page_rows from the view and paints their row colors"""
+        self.page_start = max(0, min(start, len(self.view) - 1));
+        stop = self.page_start + self.page_rows;
+        with self.recorder.stage('draw') as record:
+            self.model.df = self.view.window(self.page_start, stop);
+            #same as setRowColors(rows, color, 'all') for every color, without a redraw per color
+            colors = self.view.window_colors(self.page_start, stop);
+            self.rowcolors = pd.DataFrame({col: colors for col in self.model.df.columns}, index=self.model.df.index);
+            self.redraw();
+            record['rows'] = len(self.model.df);
+        if self.pager is not None:
+            self.pager.update();
+
+    def refresh(self):
+        """Redraws the current page after rows were appended to the view"""
+        if self.show_all:
+            self.page_rows = max(len(self.view), 1);
+        self.show_page(self.page_start);
+
     def sortTable(self, columnIndex=None, ascending=1, index=False):
-        """Set up sort order dict based on currently selected field"""
-        super().sortTable(ascending=self.ascending);
+        """Sorts the whole view on the selected field by permuting its index vector"""
+        if columnIndex is None:
+            columnIndex = self.multiplecollist;
+        if isinstance(columnIndex, int):
+            columnIndex = [columnIndex];
+        self.view.sort(self.model.df.columns[columnIndex[0]], self.ascending == 1);
         self.ascending = 1 - self.ascending;
+        self.show_page(0);
 		
     def handle_left_click(self, event):
         """Example - override left click"""
         Table.handle_left_click(self, event);
         return;
 
+class Pager:
+    """Page navigation bar above a table"""
+    def __init__(self, master, table):
+        self.table = table;
+        table.pager = self;
+        frame = tk.Frame(master);
+        frame.pack(side=tk.TOP, fill="x");
+        previous = tk.Button(frame, text="< Previous", width=int(config_dict['button_width']), command=lambda: self.move(-1));
+        previous.config(font=("Calibri", 10));
+        previous.pack(side="left", padx=(10, 10));
+        self.label = tk.Label(frame);
+        self.label.config(font=("Calibri", 12));
+        self.label.pack(side="left", expand="YES");
+        following = tk.Button(frame, text="Next >", width=int(config_dict['button_width']), command=lambda: self.move(1));
+        following.config(font=("Calibri", 10));
+        following.pack(side="right", padx=(10, 10));
+
+    def move(self, pages):
+        """Shows the previous (-1) or next (1) page"""
+        start = self.table.page_start + pages * self.table.page_rows;
+        if 0 <= start < len(self.table.view):
+            self.table.show_page(start);
+
+    def update(self):
+        """Shows the rows of the current page"""
+        stop = min(self.table.page_start + self.table.page_rows, len(self.table.view));
+        self.label.config(text='Rows %d - %d of %d' % (self.table.page_start + 1, stop, len(self.table.view)));
+
 class Input:
     """Input box frame on the top"""
     def __init__(self, master, title, action=None):
@@ -71,10 +144,28 @@ class Main(tk.Frame):
         self.inner_fields_frame_2 = None;
         self.inner_fields_frame_1 = None;
         self.input_label_frame = None;
-        self.csv_data = None;
+        self.timeline = None;
+        #files and follow flag the timeline was loaded with, Load data keeps it and its cached results while they are unchanged
+        self.loaded = None;
+        self.follow_value = None;
         self.show_data = None;
-        self.current_data = None;
-        self.reduced_data = None;
+        self.current_view = None;
+        self.reduced_view = None;
+        self.current = None;
+        self.text_index = None;
+        self.index_task = None;
+        self.task = None;
+        #task cancelled by Clear, whatever it still reports is dropped
+        self.dropped = None;
+        self.tail_task = None;
+        #parsed appended rows waiting for the running task to finish
+        self.appended = [];
+        self.loading_frame = None;
+        #time and memory of the last load, filter, search, highlight and draw, click for the details
+        self.status = tk.Label(self.master, anchor="w", relief=tk.SUNKEN);
+        self.status.config(font=("Calibri", 10));
+        self.status.pack(side=tk.BOTTOM, fill="x");
+        self.status.bind('<Button-1>', lambda event: self.stats_window());
         self.input_label_frame = tk.LabelFrame(self.master, text="Input Data");
         self.input_label_frame.config(font=("Calibri", 14));
         self.input_label_frame.pack(side=tk.TOP, anchor="n", fill="x", \
@@ -84,22 +175,97 @@ class Main(tk.Frame):
         self.__data_file_input = Input(self.inner_fields_frame_1, 'CSV File', action=self.select_file);
 
     def show_loading(self):
-        """show loading text"""
-        self.loading_label = tk.Label(self.master, text='Loading... Please Wait..');
+        """show loading text with a progress bar and a cancel button"""
+        self.hide_loading();
+        self.loading_frame = tk.Frame(self.master);
+        self.loading_frame.pack(side=tk.TOP, anchor="n", fill="x", padx=(20, 20));
+        self.loading_label = tk.Label(self.loading_frame, text='Loading... Please Wait..');
         self.loading_label.config(font=("Calibri", 16));
-        self.loading_label.pack(side=tk.TOP, anchor="n");
+        self.loading_label.pack(side="left");
+        self.progress_bar = ttk.Progressbar(self.loading_frame, mode='indeterminate', maximum=100);
+        self.progress_bar.pack(side="left", expand="YES", fill="x", padx=(10, 10));
+        cancel = tk.Button(self.loading_frame, text="Cancel", width=int(config_dict['button_width']), \
+                           command=self.cancel_task);
+        cancel.pack(side="right");
 
     def hide_loading(self):
         """hide loading text"""
-        self.loading_label.destroy();
+        if self.loading_frame is not None:
+            self.loading_frame.destroy();
+            self.loading_frame = None;
+
+    def busy(self):
+        """True while a background task is running"""
+        return self.task is not None and not self.task.finished;
+
+    def run_task(self, work, done, failed, *args, reload=True):
+        """Runs work(progress, *args) on a worker thread, done(result) or failed(exception) run on the UI thread,
+        reload is False for tasks that leave the tables in place"""
+        self.show_loading();
+        self.task = Task(work, *args).start();
+        self.master.after(POLL_MS, self.poll_task, self.task, done, failed, reload);
+
+    def poll_task(self, task, done, failed, reload=True):
+        """Drains the task queue, updating the progress bar until the task ends"""
+        for kind, value in task.poll():
+            if task is self.dropped:
+                continue;
+            if kind == 'progress':
+                self.show_progress(*value);
+            elif kind == 'done':
+                self.hide_loading();
+                done(value);
+                self.show_stats();
+            elif kind == 'error':
+                self.hide_loading();
+                failed(value);
+            elif kind == 'cancelled':
+                self.hide_loading();
+                print('Cancelled');
+                #the data from before the cancelled operation is shown again
+                if reload and self.current_view is not None and len(self.current_view) > 0:
+                    self.load_table();
+        if not task.finished:
+            self.master.after(POLL_MS, self.poll_task, task, done, failed, reload);
+
+    def show_progress(self, done, total, message):
+        """Updates the progress bar, it stays indeterminate when the total is not known"""
+        if self.loading_frame is None:
+            return;
+        if total:
+            self.progress_bar.config(mode='determinate');
+            self.progress_bar['value'] = 100.0 * done / total;
+        else:
+            self.progress_bar.step();
+        self.loading_label.config(text='Loading... ' + message);
+
+    def show_stats(self):
+        """Shows the time and memory of the last stages in the status bar"""
+        if self.timeline is not None:
+            self.status.config(text=self.timeline.recorder.status());
+
+    def stats_window(self):
+        """Displays every stage with its parts and the cost and hits of each highlight rule"""
+        if self.timeline is None:
+            return;
+        tk.messagebox.showinfo('Timings', self.timeline.recorder.report() or 'Nothing measured yet.');
+
+    def cancel_task(self):
+        """Asks the running task to stop"""
+        if self.busy():
+            self.task.cancel();
 
     def select_file(self):
-        """Selects a file, get data, convert to dataframe and load it to table"""
+        """Selects a file, or several to merge by date, get data, convert to dataframe and load it to table"""
         self.clearBtns();
-        self.__file_name = tk.filedialog.askopenfilename(initialdir=os.getcwd(), \
-                                                filetypes=(('CSV files', 'csv'),), title="Select Input CSV File.");
-        if self.__file_name is not None and self.__file_name is not '':
-            self.__data_file_input.set_data(self.__file_name);
+        file_names = tk.filedialog.askopenfilenames(initialdir=os.getcwd(), \
+                                                filetypes=(('CSV files', 'csv'),), title="Select Input CSV Files.");
+        if file_names:
+            #one file loads as before, several are merged into a super-timeline with a source_file column
+            self.__file_name = file_names[0] if len(file_names) == 1 else list(file_names);
+            #choosing files again reads them again
+            self.loaded = None;
+            self.__data_file_input.set_data('; '.join(file_names));
             self.load_btns();
         else:
             tk.messagebox.showerror(message="Please select a valid file.");
@@ -107,57 +273,169 @@ class Main(tk.Frame):
 
     def load_data(self):
         """load data from CSV file to the table"""
+        if self.busy():
+            return;
         if self.table_frame is not None:
             print('destroyed');
             self.table_frame.destroy();
         
         if self.tabControl is not None:
             self.tabControl.destroy();
-        self.show_loading();
-        self.master.update();
-        self.csv_data = None;
-        self.current_data = None;
-        self.reduced_data = None;
-        #read CSV data to Pandas dataframe and merge date and time column to one column
+        file_name, follow = self.__file_name, self.follow_value.get();
+        #a file rewritten on disk is read again, a followed one grows and its new rows are read by the tail
         try:
-            self.csv_data = pd.read_csv(self.__file_name, low_memory=False);
-            self.csv_data['date'] = pd.to_datetime((self.csv_data['date'] + " " + \
-                                                    self.csv_data['time']),infer_datetime_format=True, errors='coerce');
-        except Exception as e:
-            self.hide_loading();
-            print('Exception ', e);
-            tk.messagebox.showerror(message="No column named date, please check your CSV file.");
-        else:
-            #drop time column and set current data from CSV data
-            self.hide_loading();
-            self.csv_data = self.csv_data.drop(['time'], axis=1);
-            self.current_data = self.csv_data;
+            loaded = (file_name, follow, None if follow else [(os.path.getsize(name), os.path.getmtime(name)) for name in source_files(file_name)]);
+        except OSError:
+            #a missing file is read again, so its error is shown
+            loaded = None;
+        if self.timeline is not None and loaded is not None and loaded == self.loaded:
+            #going back to an earlier filter, also after Clear, is then answered from the result cache
             self.filter(self.filter_value_1.get());
+            return;
+        self.timeline = None;
+        self.loaded = loaded;
+        self.current_view = None;
+        self.reduced_view = None;
+        self.current = None;
+        self.text_index = None;
+        self.appended = [];
+        if self.index_task is not None:
+            self.index_task.cancel();
+        self.run_task(self.read_data, self.data_loaded, self.load_failed, file_name, follow);
+
+    def read_data(self, progress, file_name, follow):
+        """Worker: reads the CSV file, or its cached copy, and the highlight rules"""
+        return Timeline(file_name, config_dict, follow=follow).load(progress);
+
+    def data_loaded(self, timeline):
+        """keep the CSV data and apply the filter, which sets current data"""
+        self.timeline = timeline;
+        self.start_text_index(timeline);
+        self.filter(self.filter_value_1.get());
+        if timeline.tail is not None:
+            self.master.after(int(config_dict.get('tail_ms', TAIL_MS)), self.poll_tail, timeline);
+
+    def poll_tail(self, timeline):
+        """Checks a followed file for appended rows while Follow is ticked, they are parsed on a worker thread"""
+        if timeline is not self.timeline:
+            return;
+        if self.tail_task is None and self.follow_value.get() and not self.busy():
+            self.tail_task = Task(self.read_appended, timeline, None if self.current is None else self.current.key).start();
+        if self.tail_task is not None:
+            for kind, value in self.tail_task.poll():
+                if kind == 'done' and value is not None:
+                    self.appended.append(value);
+                elif kind == 'error':
+                    print('Stopped following ', timeline.file_name, value);
+                    return;
+            if self.tail_task.finished:
+                self.tail_task = None;
+        if self.appended and not self.busy():
+            self.show_appended();
+        self.master.after(POLL_MS if self.tail_task is not None else int(config_dict.get('tail_ms', TAIL_MS)), \
+                          self.poll_tail, timeline);
+
+    def read_appended(self, progress, timeline, key):
+        """Worker: parses the new rows and finds those the current filter and search keep"""
+        delta = timeline.read_appended(progress);
+        if delta is None:
+            return None;
+        return delta, None if key is None else timeline.match_appended(delta, key, progress);
+
+    def show_appended(self):
+        """Adds appended rows to the data and to the end of both views, only the shown pages are redrawn"""
+        for delta, delta_view in self.appended:
+            view = self.current;
+            if view is not None and (delta_view is None or delta_view.key != view.key):
+                #the filter or search changed while the rows were parsed
+                delta_view = self.timeline.match_appended(delta, view.key);
+            start = len(self.timeline.data);
+            self.current = self.timeline.append(delta, view, delta_view);
+            if view is None or self.current_view is None:
+                continue;
+            rows = delta_view.rows + start;
+            if delta_view.highlights is None:
+                self.current_view.extend(rows);
+                continue;
+            codes = delta_view.highlights.color_codes;
+            rule_index = delta_view.highlights.rule_index;
+            positions = delta_view.highlights.rows();
+            self.reduced_view.extend(rows[positions], codes[positions], len(self.current_view) + positions, rule_index[positions]);
+            self.current_view.extend(rows, codes, None, rule_index);
+        self.appended = [];
+        if self.current_view is None:
+            return;
+        if self.tabControl is None or not self.tabControl.winfo_exists():
+            if len(self.current_view):
+                self.load_table();
+            return;
+        self.table.refresh();
+        self.table1.refresh();
+        self.show_stats();
+
+    def start_text_index(self, timeline):
+        """Builds or loads the trigram index in the background, searches scan until it is ready"""
+        if not timeline.text_index_columns():
+            return;
+        self.index_task = Task(lambda progress: timeline.read_text_index(progress)).start();
+        self.master.after(POLL_MS, self.poll_text_index, self.index_task);
+
+    def poll_text_index(self, task):
+        """Makes the index available to search once it is built"""
+        for kind, value in task.poll():
+            if kind == 'done' and task is self.index_task:
+                self.text_index = value;
+                print('Text index ready for ', ', '.join(value.columns));
+        if not task.finished:
+            self.master.after(POLL_MS, self.poll_text_index, task);
+
+    def load_failed(self, e):
+        print('Exception ', e);
+        tk.messagebox.showerror(message="No column named date, please check your CSV file.");
 
     def save_csv(self):
-        """Save the current data to a CSV file"""
-        if self.current_data is None or len(self.current_data) == 0:
+        """Save the detailed or reduced view in the background, the file extension picks the format"""
+        if self.current_view is None or len(self.current_view) == 0:
             tk.messagebox.showerror(message="Load data before saving!");
             return;
+        if self.busy():
+            return;
+        reduced = tk.messagebox.askyesnocancel("Save", "Save only the highlighted rows of the reduced view, " \
+                                               "with their highlight color and rule?\nNo saves all rows of the detailed view.");
+        if reduced is None:
+            return;
         filename = tk.filedialog.asksaveasfilename(initialdir=os.getcwd(), \
-                    initialfile='Timeline.csv', filetypes=(('CSV files', 'csv'),), \
-                                            title="Select Input CSV File.", defaultextension='*.csv');
-        try:
-            self.current_data.to_csv(filename, index=False, encoding='utf-8');
-        except Exception as e:
-            tk.messagebox.showerror(message="Sorry, Could not save!");
-            print(e);
-        else:
-            tk.messagebox.showinfo("Success", "CSV file saved to "+filename);
+                    initialfile='Timeline.csv', filetypes=(('CSV files', '*.csv'), ('Compressed CSV files', '*.csv.gz *.csv.zst'), \
+                                                           ('Parquet files', '*.parquet'), ('Feather files', '*.feather')), \
+                                            title="Select Output File.", defaultextension='.csv');
+        if not filename:
+            return;
+        view = self.reduced_view if reduced else self.current_view;
+        #rows are written a chunk at a time on a worker thread, sorting the table meanwhile does not change the file
+        self.run_task(self.export_data, self.export_done, self.export_failed, view.snapshot(), filename, reduced, reload=False);
+
+    def export_data(self, progress, view, filename, highlight_columns):
+        """Worker: writes the view to the file"""
+        with self.timeline.recorder.stage('export', len(view)):
+            export_view(view, filename, progress, highlight_columns, int(config_dict.get('export_rows', EXPORT_ROWS)));
+        return filename;
+
+    def export_done(self, filename):
+        tk.messagebox.showinfo("Success", "File saved to "+filename);
+
+    def export_failed(self, e):
+        print(e);
+        tk.messagebox.showerror(message="Sorry, Could not save!\n" + str(e));
 
     def reset(self):
-        """Reset the data to the initial data loaded from the CSV"""
+        """Clears the tables and the filter, the loaded timeline is kept for the next Load data"""
+        self.cancel_task();
+        if self.busy():
+            self.dropped = self.task;
         self.clearBtns();
-        self.show_loading();
-        self.master.update();
-        self.current_data = None;
-        self.reduced_data = None;
         self.hide_loading();
+        self.current_view = None;
+        self.reduced_view = None;
         if self.inner_fields_frame_2 is not None:
             self.load_btns();
 
@@ -194,6 +472,12 @@ class Main(tk.Frame):
                                    width=int(config_dict['button_width']),
                                    command=self.load_data);
         self.show_data.pack(side='left', padx=10);
+        #a followed file shows rows appended to it by log2timeline/psort without reloading
+        #the flag survives Clear, so reloading the same files does not read them again
+        self.follow_value = tk.BooleanVar(value=self.follow_value is not None and self.follow_value.get());
+        follow = tk.Checkbutton(self.inner_fields_frame_2, text="Follow file", variable=self.follow_value);
+        follow.config(font=("Calibri", 12));
+        follow.pack(side='left', padx=10);
         search = tk.Button(self.inner_fields_frame_2, text="Search", width = int(config_dict['button_width']), \
                            command=self.search_window);
         search.pack(side='left', padx=10);
@@ -207,7 +491,7 @@ class Main(tk.Frame):
     def load_table(self):
         """Loads the table - excel sheet like"""
         #two views are loaded - reduced and detailed view.
-        if self.current_data is None or len(self.current_data) == 0:
+        if self.current_view is None or len(self.current_view) == 0:
             tk.messagebox.showerror(message="No data to show!");
             return;
         self.tabControl = ttk.Notebook(self.master);          # Create Tab Control
@@ -219,107 +503,32 @@ class Main(tk.Frame):
         tab2 = ttk.Frame(self.tabControl);           # Create a tab 
         self.tabControl.add(tab2, text='Detailed View');      # Add the tab
         self.tabControl.pack(expand=1, fill="both");  # Pack to make visible
+        page_rows = int(config_dict.get('page_rows', 0));
         self.table_frame = tk.Frame(tab2);
         self.table_frame.config();
+        self.table = MyTable(self.table_frame, self.current_view, page_rows, self.timeline.recorder);
+        if len(self.current_view) > self.table.page_rows or self.timeline.tail is not None:
+            Pager(tab2, self.table);
         self.table_frame.pack(anchor="c", fill=tk.BOTH, expand="YES");
-        self.current_data = self.current_data.reset_index(drop=True);
-        self.table = MyTable(self.table_frame, self.current_data);
-        #self.table.model.df = self.table.model.df.reset_index(drop=True)
         self.table.maxcellwidth = int(config_dict['max_cell_width']);
         self.table.show();
-        self.highlight();
 
+        #the reduced view is a row index view onto the same data, labelled with detailed view positions
         self.table_frame1 = tk.Frame(tab1);
         self.table_frame1.config();
+        self.table1 = MyTable(self.table_frame1, self.reduced_view, page_rows, self.timeline.recorder);
+        if len(self.reduced_view) > self.table1.page_rows or self.timeline.tail is not None:
+            Pager(tab1, self.table1);
         self.table_frame1.pack(anchor="c", fill=tk.BOTH, expand="YES");
-        self.table1 = MyTable(self.table_frame1, self.reduced_data);
-        self.table1.model.df = self.table1.model.df.reset_index(drop=False);
         self.table1.maxcellwidth = int(config_dict['max_cell_width']);
         self.table1.show();
-        self.highlight_reduced();
 
-    def highlight(self):
-        """Highlights rows based on a text"""
-        try:
-            highlights_file = open("highlights.txt", 'r')
-        except:
-            print("No highlights found!");
-            return; 
-        row_indixes = [];
-        #highlight rows based on the configuration set in the configuration.txt file
-        for row in highlights_file:
-            highlight = row.rstrip('\n').rstrip('\r')
-            if highlight:#To avoid empty rows
-                highlight_options = highlight.split('=');
-                if len(highlight_options) == 4:
-                    column = highlight_options[0].strip();
-                    if column != '*' and column not in self.csv_data.columns.values:
-                        print(column, ' -mentioned in highlights.txt - does not exist');
-                        continue;
-                    search_text = highlight_options[2].strip();
-                    highlight_color = highlight_options[3].strip();
-                    if column == '*':
-                        for col in self.table.model.df.columns:
-                            highlight = self.str_compare(self.table, highlight_options[1], col, search_text);
-                            if highlight:#set row colors
-                                self.table.setRowColors(highlight, highlight_color, 'all');row_indixes.extend(highlight);
-                    else:
-                        highlight = self.str_compare(self.table, highlight_options[1], column, search_text);
-                        if highlight:
-                            self.table.setRowColors(highlight, highlight_color, 'all');row_indixes.extend(highlight);
-                else:
-                    print('Please check your settings for highlight option.');
-                    print('This is an example of the format: *=CONTAINS=USB=#FF0000,*=ENDS=LNK=#EE0000');
-        self.reduced_data = self.current_data.iloc[sorted(set(row_indixes))];
-		
+    def show_view(self, view):
+        """Shows the rows of a filter or search in the detailed and reduced views"""
+        self.current = view;
+        self.current_view, self.reduced_view = self.timeline.table_views(view);
+        self.load_table();
 
-    def highlight_reduced(self):
-        """Highlights rows based on a text in reduced view"""
-        try:
-            highlights_file = open("highlights.txt", 'r');
-        except:
-            print("No highlights found!");
-            return; 
-        for row in highlights_file:
-            highlight = row.rstrip('\n').rstrip('\r')
-            if highlight:#To avoid empty rows
-                highlight_options = highlight.split('=');
-                if len(highlight_options) == 4:
-                    column = highlight_options[0].strip();
-                    if column != '*' and column not in self.reduced_data.columns.values:
-                        print(column, ' -mentioned in highlights.txt - does not exist')
-                        continue;
-                    search_text = highlight_options[2].strip();
-                    highlight_color = highlight_options[3].strip();
-                    if column == '*':
-                        for col in self.table1.model.df.columns:
-                            highlight = self.str_compare(self.table1, highlight_options[1], col, search_text);
-                            if highlight and len(highlight) > 0:
-                                self.table1.setRowColors(highlight, highlight_color, 'all');
-                    else:
-                        highlight = self.str_compare(self.table1, highlight_options[1], column, search_text);
-                        if highlight and len(highlight) > 0:
-                            self.table1.setRowColors(highlight, highlight_color, 'all');
-                else:
-                    print('Please check your settings for highlight option.');
-                    print('This is an example of the format: *=CONTAINS=USB=#FF0000,*=ENDS=LNK=#EE0000');
-
-    
-    def str_compare(self, table_model, compare_type, column, search_text):
-        """Performs the kind of string compare as configured in highlights.txt"""
-        if compare_type.upper() == 'ENDS':
-            return table_model.model.df.index[\
-                            table_model.model.df[column].astype(str).str.lower().astype(str).str.endswith(search_text.lower(), na=False)].tolist();
-        elif compare_type.upper() == 'STARTS':
-            return table_model.model.df.index[\
-                            table_model.model.df[column].astype(str).str.lower().astype(str).str.startswith(search_text.lower(), na=False)].tolist();
-        elif compare_type.upper() == 'EQUALS':
-            return table_model.model.df.index[\
-                            table_model.model.df[column].astype(str).str.lower() == search_text.lower()].tolist();
-        elif compare_type.upper() == 'CONTAINS':
-            return table_model.model.df.index[\
-                            table_model.model.df[column].astype(str).str.contains(search_text, na=False, case=False)].tolist();
-                            
     def help_window(self):
         """Displays a help window box with instructions"""
         lines = ['You may enter the query to filter the data based on column names.',\
@@ -329,6 +538,7 @@ class Main(tk.Frame):
                  'For date comparisons, you can either give date alone or date time.',
                  'If only date is given, the query considers the default time to be 00:00:00',
                  'Preferred date format is YYYY-MM-DD HH:MM:SS, though the program will try to infer other valid date formats.',
+                 'Dates are in UTC, converted from the timezone column of the CSV.',
                  '', 'A few of the examples are:',
                  "date > '2017-01-01' and date < '2018-01-01'",
                  "date == '2015-03-16 10:53:00'",
@@ -362,45 +572,49 @@ class Main(tk.Frame):
 
     def search(self, srch_value):
         """Performs case insensitive search on data loaded from CSV"""
-        if self.current_data is None or len(self.current_data) == 0:
+        if self.current_view is None or len(self.current_view) == 0:
             tk.messagebox.showerror(message="No data to search! Please load data first.");
             return;
         if srch_value is None or srch_value is '':
             tk.messagebox.showerror(message="Enter a search value!");
             return;
+        if self.busy():
+            return;
         if self.table_frame:
             self.table_frame.destroy();
         if self.tabControl:
             self.tabControl.destroy();
-        self.show_loading();
-        self.master.update();
         self.search_win.destroy();
-        mask = np.column_stack(\
-            [self.current_data[col].astype(str).str.lower().astype(str).str.contains(srch_value.lower(), na=False, regex=True) for col in self.current_data])
-        self.current_data = self.current_data.loc[mask.any(axis=1)];
-        self.hide_loading();
-        self.load_table();
+        self.run_task(self.search_data, self.show_view, self.search_failed, \
+                      self.current._replace(rows=self.current_view.rows), self.text_index, srch_value);
+
+    def search_data(self, progress, view, text_index, srch_value):
+        """Worker: keeps the rows where any column contains the search value"""
+        return self.timeline.search(view, srch_value, progress, text_index);
+
+    def search_failed(self, e):
+        print('Exception ', e);
+        tk.messagebox.showerror(message="Check your search value!");
 
     def filter(self, query):
         """Filter data based on the query"""
         #if query == '':
         #    tk.messagebox.showerror(message="Empty query!");
         #    return;
+        if self.busy():
+            return;
         if self.table_frame:
             self.table_frame.destroy()
-        self.show_loading();
-        self.master.update();
         print('Query : ', query);
-        try:
-            if query != '':
-                self.current_data = self.csv_data.query(query)
-        except Exception as e:
-            self.hide_loading();
-            print('Exception ', e)
-            tk.messagebox.showerror(message="Check your query!");
-        else:
-            self.hide_loading();
-            self.load_table();
+        self.run_task(self.query_data, self.show_view, self.filter_failed, query);
+
+    def query_data(self, progress, query):
+        """Worker: runs the query on the CSV data"""
+        return self.timeline.filter(query, progress);
+
+    def filter_failed(self, e):
+        print('Exception ', e)
+        tk.messagebox.showerror(message="Check your query!");
 
 def get_reduced_data(self, query):
         """Get data in reduced view - those that are highlighted"""
@@ -416,26 +630,21 @@ def get_reduced_data(self, query):
             self.load_table();
 
 
-#create Tkinter application and get the configuration from the text file
+#--batch runs headless, otherwise create Tkinter application and get the configuration from the text file
 #for settings
 if __name__ == '__main__':
+    if '--batch' in sys.argv[1:]:
+        from batch import run_batch
+        sys.exit(run_batch([arg for arg in sys.argv[1:] if arg != '--batch']));
     root = tk.Tk()
     root.resizable(True, True)
 	
     try:
-        config_file = open("configuration.txt", 'r')
+        config_dict = read_configuration("configuration.txt");
     except:
         tk.messagebox.showerror(message="Configuration Error: \
         The configuration.txt file should be in the same folder as python file.");
     else:
-        config_dict = {}
-        for row in config_file:
-            row = row.rstrip('\n').rstrip('\r');
-            if row:#To avoid empty rows
-                key_values = row.split('=', 1);
-                #print('key_values ', key_values)
-                key_values[1] = key_values[1].rstrip('\n').rstrip('\r');
-                config_dict[key_values[0]] = key_values[1];
         root.geometry("%dx%d+0+0" % (int(config_dict['window_x']),int(config_dict['window_y'])));
         title = 'Timeline Highlight';
         root.title(title);
@@ -0,0 +1,115 @@
+"""
+Headless batch mode
+Runs filter, highlight and reduce over many timelines in a process pool and writes each reduced view with its rule hit counts
+"""
+import argparse
+import csv
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from engine import Timeline, read_configuration, CONFIG_FILE
+from export import export_view, EXPORT_ROWS
+
+SUMMARY_FILE = 'summary.csv';
+
+def parse_args(argv):
+    """Options of Timeline2GUI.py --batch"""
+    parser = argparse.ArgumentParser(prog='Timeline2GUI.py --batch', \
+                                     description='Filter and highlight timeline CSV files without the user interface.');
+    parser.add_argument('files', nargs='+', help='timeline CSV files, wildcards are expanded');
+    parser.add_argument('--query', default='', help='filter query, as typed in Filter Columns');
+    parser.add_argument('--search', default='', help='keep only rows containing this text');
+    parser.add_argument('--highlights', default='highlights.txt', help='highlight rules file');
+    parser.add_argument('--reduced-out', default='.', help='directory for the reduced views and hit counts');
+    parser.add_argument('--format', default='csv', choices=['csv', 'csv.gz', 'csv.zst', 'parquet', 'feather'], \
+                        help='file format of the reduced views');
+    parser.add_argument('--workers', type=int, default=None, help='processes to run, batch_workers in the configuration by default');
+    parser.add_argument('--config', default=CONFIG_FILE, help='configuration file');
+    return parser.parse_args(argv);
+
+def expand_files(patterns):
+    """Input files, with wildcards expanded where the shell did not"""
+    files = [];
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern];
+        files.extend(name for name in matches if name not in files);
+    return files;
+
+def output_names(files, out_dir):
+    """Output prefix per input file, named after the file and numbered when names repeat"""
+    names = {};
+    used = set();
+    for file_name in files:
+        stem = os.path.splitext(os.path.basename(file_name))[0];
+        name, number = stem, 1;
+        while name in used:
+            number += 1;
+            name = '%s_%d' % (stem, number);
+        used.add(name);
+        names[file_name] = os.path.join(out_dir, name);
+    return names;
+
+def write_hits(file_name, hits):
+    """One row per highlight rule with the number of rows it matched"""
+    with open(file_name, 'w', newline='', encoding='utf-8') as hits_file:
+        writer = csv.writer(hits_file);
+        writer.writerow(['column', 'type', 'text', 'color', 'hits']);
+        for rule, count in hits:
+            writer.writerow([rule.column, rule.compare_type, rule.text, rule.color, int(count)]);
+
+def process_file(file_name, prefix, options, config):
+    """Worker process: load, filter, search and highlight one timeline, then save its reduced view and hits"""
+    start = time.time();
+    timeline = Timeline(file_name, config, options.highlights).load();
+    view = timeline.filter(options.query);
+    if options.search:
+        #one search per file, building a text index for it would cost far more than the scan
+        view = timeline.search(view, options.search, text_index=None);
+    _, reduced = timeline.table_views(view);
+    export_view(reduced, prefix + '_reduced.' + options.format, highlight_columns=True, \
+                chunk_rows=int(config.get('export_rows', EXPORT_ROWS)));
+    write_hits(prefix + '_hits.csv', timeline.rule_hits(view));
+    return {'file': file_name, 'rows': len(timeline.data), 'filtered': len(view.rows), \
+            'reduced': len(reduced), 'seconds': round(time.time() - start, 3), 'error': ''};
+
+def run_batch(argv):
+    """Entry point of --batch, returns the process exit status"""
+    options = parse_args(argv);
+    try:
+        config = read_configuration(options.config);
+    except OSError as e:
+        print('Configuration Error: ', e);
+        return 2;
+    files = expand_files(options.files);
+    if not files:
+        print('No timeline files found!');
+        return 2;
+    workers = options.workers or int(config.get('batch_workers', 0)) or os.cpu_count() or 1;
+    workers = max(1, min(workers, len(files)));
+    if workers > 1:
+        #files already run side by side, each one scans its columns in a single process
+        config = dict(config, scan_workers='1');
+    os.makedirs(options.reduced_out, exist_ok=True);
+    prefixes = output_names(files, options.reduced_out);
+    print('Processing ', len(files), ' files with ', workers, ' workers');
+    results = [];
+    #every file is parsed in its own process, so memory use grows with the worker count
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_file, file_name, prefixes[file_name], options, config): file_name for file_name in files};
+        for future in as_completed(futures):
+            file_name = futures[future];
+            try:
+                result = future.result();
+            except Exception as e:
+                result = {'file': file_name, 'rows': '', 'filtered': '', 'reduced': '', 'seconds': '', 'error': str(e)};
+                print('Failed ', file_name, ' : ', e);
+            else:
+                print('Done ', file_name, ' : ', result['reduced'], ' of ', result['rows'], ' rows highlighted');
+            results.append(result);
+    results.sort(key=lambda result: files.index(result['file']));
+    with open(os.path.join(options.reduced_out, SUMMARY_FILE), 'w', newline='', encoding='utf-8') as summary_file:
+        writer = csv.DictWriter(summary_file, fieldnames=['file', 'rows', 'filtered', 'reduced', 'seconds', 'error']);
+        writer.writeheader();
+        writer.writerows(results);
+    return 1 if any(result['error'] for result in results) else 0;
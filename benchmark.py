@@ -0,0 +1,201 @@
+"""
+Benchmark of the timeline engine
+Generates synthetic log2timeline CSV files and times load, highlight, search and filter on them without the user interface, as JSON
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from engine import Timeline, read_configuration, CONFIG_FILE
+from instrument import peak_memory, in_megabytes
+
+GENERATE_ROWS = 100000;
+DEFAULT_SIZES = '100k,1M,10M';
+DEFAULT_QUERY = "type == 'Last Access Time' and date >= '2017-07-01'";
+DEFAULT_SEARCH = 'usb';
+COLUMNS = ['date', 'time', 'timezone', 'MACB', 'source', 'sourcetype', 'type', 'user', 'host', 'short', 'desc', \
+           'version', 'filename', 'inode', 'notes', 'format', 'extra'];
+#categorical values in falling order of frequency, picked with zipf weights as in real timelines
+SOURCES = [('FILE', 'NTFS $MFT', 'mft'), ('REG', 'Registry Key', 'winreg'), ('EVT', 'WinEVTX', 'winevtx'), \
+           ('WEBHIST', 'Chrome History', 'chrome_history'), ('LNK', 'Windows Shortcut', 'lnk'), \
+           ('LOG', 'Setupapi Log', 'setupapi'), ('PE', 'PE Compilation time', 'pe'), \
+           ('REG', 'UserAssist key', 'winreg'), ('RECBIN', 'Recycle Bin', 'recycle_bin'), ('OLECF', 'OLECF Item', 'olecf')];
+TYPES = ['Last Access Time', 'Content Modification Time', 'Metadata Modification Time', 'Creation Time', \
+         'Last Visited Time', 'Last Time Executed', 'Expiration Time'];
+MACB = ['.A..', 'M...', '..C.', '...B', 'MACB', 'M.C.', '.AC.'];
+USERS = ['-', 'Administrator', 'analyst', 'SYSTEM', 'backup', 'guest'];
+HOSTS = ['WKS-FIN-01', 'WKS-FIN-02', 'SRV-DC-01', 'WKS-HR-07', 'LAPTOP-CEO'];
+#short/desc patterns, a few of them match rules of the bundled highlights.txt
+EVENTS = ['{path}', 'Visited: {path} (Chrome)', 'visited file://{path}', 'URL:file:///{path}', \
+          'File opened by Explorer: {path}', '[USBSTOR] Disk&Ven_Kingston&Prod_DataTraveler serial {id}', \
+          'CreateDate {path}', 'Prefetch [{name}.EXE] was executed - run count {id}', \
+          'Link target: {path}.lnk', 'Service installed: {name} image path {path}'];
+DIRECTORIES = ['C:/Windows/System32', 'C:/Users/analyst/AppData/Roaming/Microsoft/Windows/Recent', \
+               'C:/Program Files (x86)/Google/Chrome/Application', 'C:/Users/Administrator/Documents/Projects', \
+               'E:/Transfer', 'C:/ProgramData/Microsoft/Windows/Start Menu/Programs'];
+
+def zipf_choice(generator, count, rows, exponent=1.3):
+    """Indexes below count, the first ones much more frequent than the last"""
+    weights = 1.0 / np.arange(1, count + 1) ** exponent;
+    return generator.choice(count, size=rows, p=weights / weights.sum());
+
+def generate_chunk(generator, start, rows, total):
+    """One chunk of a synthetic timeline, dates rise from 2017-01-01 over a year"""
+    #each chunk covers its share of the year, so the file is in date order like psort output
+    span = 365 * 86400 * rows // total;
+    seconds = 365 * 86400 * start // total + np.sort(generator.integers(0, max(span, 1), size=rows));
+    stamps = pd.Timestamp('2017-01-01') + pd.to_timedelta(seconds, unit='s');
+    sources = zipf_choice(generator, len(SOURCES), rows);
+    events = zipf_choice(generator, len(EVENTS), rows);
+    directories = zipf_choice(generator, len(DIRECTORIES), rows);
+    #file ids are skewed too, a few files appear often and most only once or twice
+    file_ids = zipf_choice(generator, max(total // 4, 1), rows, 1.05);
+    names = ['file%d' % file_id for file_id in file_ids];
+    paths = ['%s/%s.dat' % (DIRECTORIES[d], name) for d, name in zip(directories, names)];
+    ids = generator.integers(0, 1 << 31, size=rows);
+    numbers = ids.tolist();
+    shorts = [EVENTS[e].format(path=path, name=name, id=i) for e, path, name, i in zip(events, paths, names, numbers)];
+    #desc and extra are long like real plaso output, hundreds of characters per row
+    descs = ['%s Origin: %s Owner SID: S-1-5-21-%d-%d Volume serial: %08X File reference: %d-%d Attributes: archive, not content indexed' \
+             % (short, path, i % 99991, i % 7919, i, i % 65536, i % 17) for short, path, i in zip(shorts, paths, numbers)];
+    extras = ['md5_hash: %s sha256_hash: %s size: %d parser: %s is_allocated: True number_of_links: 1 data_type: fs:stat' \
+              % (hashlib.md5(b'%d' % i).hexdigest(), hashlib.sha256(b'%d' % i).hexdigest(), i % 1048576, SOURCES[s][2]) for i, s in zip(numbers, sources)];
+    inodes = np.where(ids % 5 == 0, '-', (ids % 900000).astype(str));
+    return pd.DataFrame({'date': stamps.strftime('%m/%d/%Y'), 'time': stamps.strftime('%H:%M:%S'), 'timezone': 'UTC', \
+                         'MACB': np.array(MACB)[zipf_choice(generator, len(MACB), rows)], \
+                         'source': [SOURCES[s][0] for s in sources], 'sourcetype': [SOURCES[s][1] for s in sources], \
+                         'type': np.array(TYPES)[zipf_choice(generator, len(TYPES), rows)], \
+                         'user': np.array(USERS)[zipf_choice(generator, len(USERS), rows)], \
+                         'host': np.array(HOSTS)[zipf_choice(generator, len(HOSTS), rows)], \
+                         'short': shorts, 'desc': descs, 'version': 2, 'filename': paths, 'inode': inodes, \
+                         'notes': '-', 'format': [SOURCES[s][2] for s in sources], 'extra': extras}, columns=COLUMNS);
+
+def generate_timeline(file_name, rows, seed=0):
+    """Write a synthetic l2t_csv timeline of the given number of rows, GENERATE_ROWS at a time"""
+    generator = np.random.default_rng(seed);
+    with open(file_name, 'w', newline='', encoding='utf-8') as csv_file:
+        for start in range(0, rows, GENERATE_ROWS):
+            chunk = generate_chunk(generator, start, min(GENERATE_ROWS, rows - start), rows);
+            chunk.to_csv(csv_file, header=start == 0, index=False);
+    return file_name;
+
+def parse_rows(text):
+    """Row count written like 100000, 100k or 1M"""
+    text = text.strip().lower();
+    scale = {'k': 1000, 'm': 1000000}.get(text[-1:], 1);
+    return int(float(text[:-1] if scale > 1 else text) * scale);
+
+def size_name(rows):
+    """100k or 1M for a row count"""
+    if rows % 1000000 == 0:
+        return '%dM' % (rows // 1000000);
+    return '%dk' % (rows // 1000) if rows % 1000 == 0 else str(rows);
+
+def timeline_file(data_dir, rows, seed):
+    """Synthetic timeline of this size, generated once and reused by later runs"""
+    file_name = os.path.join(data_dir, 'l2t_%s_seed%d.csv' % (size_name(rows), seed));
+    if not os.path.exists(file_name):
+        print('Generating ', file_name);
+        os.makedirs(data_dir, exist_ok=True);
+        generate_timeline(file_name + '.part', rows, seed);
+        os.replace(file_name + '.part', file_name);
+    return file_name;
+
+def measure(stages, name, rows, work):
+    """Run work(), record its wall time, rows per second and peak memory under name, return its result"""
+    peak_before = peak_memory();
+    start = time.perf_counter();
+    result = work();
+    seconds = time.perf_counter() - start;
+    peak = peak_memory();
+    stages[name] = {'seconds': round(seconds, 4), 'rows': int(rows), \
+                    'rows_per_second': round(rows / seconds) if seconds > 0 else None, \
+                    'peak_rss_mb': in_megabytes(peak), \
+                    'peak_rss_growth_mb': None if peak is None else in_megabytes(peak - peak_before)};
+    print('  %-10s %9.3f s %12s rows/s  peak %s MB' % (name, seconds, stages[name]['rows_per_second'], stages[name]['peak_rss_mb']));
+    return result;
+
+def run_size(file_name, total, config, options):
+    """Worker process: the stages of the GUI on one timeline, a fresh process per size so peak memory is its own"""
+    stages = {};
+    timeline = Timeline(file_name, config, options.highlights);
+    measure(stages, 'load', total, timeline.load);
+    #the rule costs of the results include each rule's share of the candidate scan
+    if timeline.rules is not None:
+        timeline.rules.share_costs = True;
+    #the recorder splits load into csv parsing, date parsing and the rest
+    stages['load']['parts'] = timeline.recorder.stages['load']['parts'];
+    key, rows = timeline.result_cache.query('');
+    view = measure(stages, 'highlight', total, lambda: timeline.highlight(key, rows));
+    rules = list(timeline.recorder.rules);
+    text_index = None;
+    if timeline.text_index_columns():
+        text_index = measure(stages, 'text_index', total, timeline.read_text_index);
+    #search and filter are timed without highlighting their rows, highlight is its own stage
+    measure(stages, 'search', total, lambda: timeline.search_rows(view, options.search, text_index=text_index));
+    _, filtered = measure(stages, 'filter', total, lambda: timeline.filter_rows(options.query));
+    return {'file': file_name, 'rows': len(timeline.data), 'filtered': len(filtered), \
+            'highlighted': 0 if view.highlights is None else len(view.highlights.rows()), 'stages': stages, 'rules': rules};
+
+def environment():
+    """Versions and machine the results were measured with"""
+    return {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__, \
+            'platform': platform.platform(), 'cpus': os.cpu_count()};
+
+def parse_args(argv):
+    """Options of benchmark.py"""
+    parser = argparse.ArgumentParser(prog='benchmark.py', \
+                                     description='Time load, highlight, search and filter on synthetic timelines.');
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='comma separated row counts, like 100k,1M,10M');
+    parser.add_argument('--data-dir', default='benchmark_data', help='folder of the generated timelines, reused between runs');
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the generated timelines');
+    parser.add_argument('--highlights', default='highlights.txt', help='highlight rules file');
+    parser.add_argument('--query', default=DEFAULT_QUERY, help='filter query, as typed in Filter Columns');
+    parser.add_argument('--search', default=DEFAULT_SEARCH, help='search text');
+    parser.add_argument('--config', default=CONFIG_FILE, help='configuration file, its cache is turned off unless --cache is given');
+    parser.add_argument('--cache', action='store_true', help='keep the cache, load then measures reading the cached copy');
+    parser.add_argument('--text-index', default='', help='columns to build a text index of and search with, like short,filename, needs --cache');
+    parser.add_argument('--label', default='', help='name of this run in the results, like a version or commit');
+    parser.add_argument('--output', default='', help='JSON results file, printed when not given');
+    return parser.parse_args(argv);
+
+def main(argv):
+    """Entry point, returns the process exit status"""
+    options = parse_args(argv);
+    try:
+        config = read_configuration(options.config);
+    except OSError as e:
+        print('Configuration Error: ', e);
+        return 2;
+    if not options.cache:
+        #the cache would turn later runs into reading memory mapped copies, load should measure parsing
+        config = dict(config, cache_dir='', cache_size_mb='0');
+        if options.text_index:
+            print('--text-index needs --cache, searches scan the columns');
+    #the text index of the configuration is only measured when asked for, its build dwarfs the other stages
+    config = dict(config, text_index_columns=options.text_index);
+    results = {'label': options.label, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'environment': environment(), \
+               'config': config, 'query': options.query, 'search': options.search, 'sizes': {}};
+    for rows in [parse_rows(size) for size in options.sizes.split(',') if size.strip()]:
+        file_name = timeline_file(options.data_dir, rows, options.seed);
+        print('Benchmark ', file_name);
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            results['sizes'][size_name(rows)] = pool.submit(run_size, file_name, rows, config, options).result();
+    text = json.dumps(results, indent=2);
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as output_file:
+            output_file.write(text);
+        print('Results written to ', options.output);
+    else:
+        print(text);
+    return 0;
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]));
@@ -0,0 +1,242 @@
+"""
+Timeline processing engine
+Load, filter, search, highlight and reduce a timeline without any user interface, shared by the GUI and batch mode
+"""
+import os
+from collections import namedtuple
+import numpy as np
+from highlighter import load_rules
+from storage import TimelineCache, ChunkedFrame, MemoryChunks, source_files, directory_size
+from loader import read_timeline, read_chunks, concat_chunks, TailReader, DEFAULT_CHUNK_ROWS
+from merge import merge_timelines, merged_chunks
+from workers import no_progress
+from parallel import Scanner
+from instrument import Recorder, peak_memory, timed
+from views import TableView
+from indexes import TrigramIndex, FilterIndex, ChunkedFilterIndex, ResultCache, search_mask
+
+CONFIG_FILE = 'configuration.txt';
+
+#rows of a filter or search, their cache key and the highlight rules evaluated over them
+View = namedtuple('View', ['key', 'rows', 'highlights']);
+
+def read_configuration(file_name=CONFIG_FILE):
+    """Read key=value settings, raises OSError when the file is missing"""
+    config = {};
+    with open(file_name, 'r') as config_file:
+        for row in config_file:
+            row = row.rstrip('\n').rstrip('\r');
+            if row:#To avoid empty rows
+                key_values = row.split('=', 1);
+                config[key_values[0]] = key_values[1];
+    return config;
+
+def megabytes(config, key):
+    """Size setting given in MB, in bytes"""
+    return int(config.get(key, 0)) * 1024 * 1024;
+
+class Timeline:
+    """One timeline CSV, or a list of them merged by date, with its indexes, highlight rules and cached results"""
+    def __init__(self, file_name, config, highlights_file="highlights.txt", follow=False):
+        self.file_name = file_name;
+        #a followed file is still being written, rows appended to it are read by read_appended
+        self.follow = follow;
+        self.tail = None;
+        self.config = config;
+        self.highlights_file = highlights_file;
+        self.cache = TimelineCache(config.get('cache_dir', ''), megabytes(config, 'cache_size_mb'));
+        self.data = None;
+        self.filter_index = None;
+        self.rules = None;
+        self.result_cache = None;
+        self.text_index = None;
+        #search and highlight use scan_workers processes on columns with many distinct values
+        self.scanner = Scanner(int(config.get('scan_workers', 1)));
+        #time and memory of every stage and the cost of each highlight rule, logged to stats_log when it is set
+        self.recorder = Recorder(config.get('stats_log', ''));
+
+    def load(self, progress=no_progress):
+        """Read the CSV file, or its cached copy, index its dates and parse the highlight rules"""
+        with self.recorder.stage('load') as record:
+            chunk_rows = int(self.config.get('chunk_rows', DEFAULT_CHUNK_ROWS));
+            if self.follow and not isinstance(self.file_name, str):
+                print('Only a single file can be followed, loading without following');
+                self.follow = False;
+            data = None;
+            if self.follow:
+                #a file still being written is neither cached nor memory mapped, its chunks stay in memory to append to
+                self.tail = TailReader(self.file_name, chunk_rows);
+                chunks = self.tail.read(progress);
+                if not chunks:
+                    raise ValueError(self.file_name + ' has no complete rows yet');
+                data = MemoryChunks(chunks, chunk_rows);
+            else:
+                #a previously parsed copy of the same file is read from the cache, its numeric columns memory mapped
+                with timed('cache read'):
+                    data = self.cache.load(self.file_name);
+            if data is None:
+                if self.out_of_core():
+                    #converted once into chunks in the cache folder, later loads only map the chunk list
+                    if isinstance(self.file_name, str):
+                        chunks = read_chunks(self.file_name, chunk_rows, progress);
+                    else:
+                        chunks = merged_chunks(self.file_name, chunk_rows, progress, self.spill_dir());
+                    data = self.cache.store_chunks(self.file_name, chunks, progress);
+                elif isinstance(self.file_name, str):
+                    #read CSV data in chunks to a typed dataframe with date and time merged to one column
+                    data = read_timeline(self.file_name, chunk_rows, progress);
+                else:
+                    #several hosts are streamed into one super-timeline, spilling to the cache folder
+                    data = merge_timelines(self.file_name, chunk_rows, progress, self.spill_dir());
+                if not isinstance(data, ChunkedFrame):
+                    progress(0, None, 'caching');
+                    with timed('caching'):
+                        self.cache.store(self.file_name, data);
+            progress(0, None, 'indexing dates');
+            #sorted dates let filters answer date ranges by binary search, chunk by chunk when out of core
+            with timed('date index'):
+                filter_index = ChunkedFilterIndex(data) if isinstance(data, ChunkedFrame) else FilterIndex(data);
+            peak = peak_memory();
+            print('Loaded ', len(data), ' rows, peak memory ', \
+                  'unknown' if peak is None else '%.0f MB' % (peak / 1048576));
+            #highlights.txt is parsed once per load and shared by every view
+            self.data, self.filter_index, self.rules = data, filter_index, load_rules(self.highlights_file);
+            if self.rules is not None:
+                self.rules.scanner = self.scanner;
+                self.rules.share_costs = self.recorder.enabled;
+            #earlier filters and searches on this data are kept so going back to them is instant
+            self.result_cache = ResultCache(filter_index, megabytes(self.config, 'result_cache_mb'));
+            record['rows'] = len(data);
+        return self;
+
+    def out_of_core(self):
+        """True when the files are larger than out_of_core_mb, they are then kept in the cache folder instead of memory"""
+        limit = megabytes(self.config, 'out_of_core_mb');
+        if not limit or sum(os.path.getsize(name) for name in source_files(self.file_name)) <= limit:
+            return False;
+        if not self.cache.enabled:
+            print('Out-of-core mode needs cache_dir and cache_size_mb, loading into memory');
+            return False;
+        return True;
+
+    def spill_dir(self):
+        """Folder for temporary files of a merge, the cache folder when there is one"""
+        directory = self.config.get('cache_dir', '');
+        if not directory:
+            return None;
+        os.makedirs(directory, exist_ok=True);
+        return directory;
+
+    def text_index_columns(self):
+        """Columns named by text_index_columns in the configuration, none out of core where searches scan chunks
+        and none without a cache folder to keep the index in"""
+        if isinstance(self.data, ChunkedFrame) or not self.cache.enabled:
+            return [];
+        return [col.strip() for col in self.config.get('text_index_columns', '').split(',') if col.strip()];
+
+    def read_text_index(self, progress=no_progress):
+        """Load the trigram index kept next to the cached data, or build and save it,
+        None if none is configured or it would not fit in the cache"""
+        columns = self.text_index_columns();
+        directory = self.cache.entry_dir(self.file_name) if columns else None;
+        if directory is None:
+            return None;
+        with self.recorder.stage('text index', len(self.data)):
+            with timed('index read'):
+                index = TrigramIndex.load(os.path.join(directory, 'trigrams'), self.data);
+            if index is None or set(index.columns) != set(col for col in columns if col in self.data.columns):
+                #an index the cache cannot hold next to its data would only evict every other entry
+                size = TrigramIndex.estimate_bytes(self.data, columns);
+                if size + directory_size(directory) > self.cache.max_bytes:
+                    print('A text index of ', ', '.join(columns), ' could need ', size // 1048576, \
+                          ' MB, more than cache_size_mb allows, searches scan the columns instead');
+                    return None;
+                with timed('index build'):
+                    index = TrigramIndex.build(self.data, columns, progress);
+                index.save(os.path.join(directory, 'trigrams'));
+                self.cache.evict(keep=os.path.basename(directory));
+        return index;
+
+    def highlight(self, key, rows, progress=no_progress):
+        """Evaluate the highlight rules once over the rows, unless they are cached"""
+        if self.rules is None:
+            return View(key, rows, None);
+        entry = self.result_cache.get(key);
+        if entry is not None and entry[1] is not None and entry[0] is rows:
+            return View(key, rows, entry[1]);
+        with self.recorder.stage('highlight', len(rows)):
+            highlights = self.rules.evaluate(self.data, progress, rows);
+        self.recorder.rule_costs(self.rules.names(), highlights);
+        self.result_cache.set_highlights(key, highlights);
+        return View(key, rows, highlights);
+
+    def filter_rows(self, query, progress=no_progress):
+        """(result key, rows) matching the query, without highlighting them"""
+        progress(0, None, 'filtering');
+        #date ranges and categorical equalities come from the indexes, the rest goes to DataFrame.query,
+        #a query adding terms to a cached one is only evaluated on the cached rows
+        with self.recorder.stage('filter') as record:
+            key, rows = self.result_cache.query(query, progress);
+            record['rows'] = len(rows);
+        return key, rows;
+
+    def filter(self, query, progress=no_progress):
+        """Rows matching the query, with their highlights"""
+        key, rows = self.filter_rows(query, progress);
+        return self.highlight(key, rows, progress);
+
+    def search_rows(self, view, term, progress=no_progress, text_index=None):
+        """(result key, rows) of a view where any column contains the term, without highlighting them"""
+        #indexed text columns only verify candidate rows, other columns are scanned
+        with self.recorder.stage('search') as record:
+            key, rows = self.result_cache.search(view.key, view.rows, term, \
+                                                 lambda rows, term: search_mask(self.data, term, rows, text_index, progress, self.scanner));
+            record['rows'] = len(rows);
+        return key, rows;
+
+    def search(self, view, term, progress=no_progress, text_index=None):
+        """Rows of a view where any column contains the term, with their highlights"""
+        key, rows = self.search_rows(view, term, progress, text_index);
+        return self.highlight(key, rows, progress);
+
+    def read_appended(self, progress=no_progress):
+        """Rows appended to a followed file since the last read, parsed but not yet added to the data, None if there are none"""
+        with self.recorder.stage('tail read') as record:
+            delta = concat_chunks(self.tail.read(progress));
+            record['rows'] = 0 if delta is None else len(delta);
+        return delta;
+
+    def match_appended(self, delta, key, progress=no_progress):
+        """View of the positions of appended rows that the filter and search of key keep, with their highlights"""
+        rows = self.result_cache.matching(key, delta, progress);
+        highlights = None if self.rules is None else self.rules.evaluate(delta, progress, rows);
+        return View(key, rows, highlights);
+
+    def append(self, delta, view=None, delta_view=None):
+        """Add appended rows to the data and to a view, returns the extended view"""
+        start = len(self.data);
+        self.data.append(delta);
+        #other cached results do not have the new rows
+        self.result_cache.clear();
+        if view is None:
+            return None;
+        rows = np.concatenate([view.rows, delta_view.rows + start]);
+        highlights = None if view.highlights is None else view.highlights.extend(delta_view.highlights);
+        self.result_cache.put(view.key, rows, highlights);
+        return View(view.key, rows, highlights);
+
+    def table_views(self, view):
+        """Detailed TableView of a view and the reduced TableView of its highlighted rows"""
+        if view.highlights is None:
+            detailed = TableView(self.data, view.rows);
+            return detailed, detailed.take([]);
+        highlights = view.highlights;
+        detailed = TableView(self.data, view.rows, highlights.color_codes, highlights.palette, \
+                             None, highlights.rule_index, self.rules.names());
+        return detailed, detailed.take(highlights.rows());
+
+    def rule_hits(self, view):
+        """(rule, hit count) of every highlight rule over the rows of a view"""
+        if view.highlights is None:
+            return [];
+        return list(zip(self.rules.rules, view.highlights.hits));
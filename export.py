@@ -0,0 +1,123 @@
+"""
+Export of table views
+Views are written a chunk of rows at a time as CSV, compressed CSV, Parquet or Feather, chosen by the file extension
+"""
+import gzip
+import os
+import pandas as pd
+from storage import take_rows
+from workers import no_progress
+
+EXPORT_ROWS = 100000;
+#longest extensions first, anything else is written as plain CSV
+FORMATS = [('.csv.gz', 'csv', 'gzip'), ('.csv.zst', 'csv', 'zstd'), ('.gz', 'csv', 'gzip'), ('.zst', 'csv', 'zstd'), \
+           ('.parquet', 'parquet', None), ('.feather', 'feather', None), ('.arrow', 'feather', None)];
+
+def output_format(file_name):
+    """(format, compression) of a file name"""
+    for extension, output, compression in FORMATS:
+        if file_name.lower().endswith(extension):
+            return output, compression;
+    return 'csv', None;
+
+class CsvWriter:
+    """Appends chunks to a CSV file, the header is written with the first chunk"""
+    def __init__(self, file_name, compression=None):
+        if compression == 'gzip':
+            self.handle = gzip.open(file_name, 'wt', encoding='utf-8', newline='');
+        elif compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError('Saving .zst files needs the zstandard package, pip install zstandard');
+            self.handle = zstandard.open(file_name, 'wt', encoding='utf-8', newline='');
+        else:
+            self.handle = open(file_name, 'w', encoding='utf-8', newline='');
+        self.header = True;
+
+    def write(self, chunk):
+        chunk.to_csv(self.handle, header=self.header, index=False);
+        self.header = False;
+
+    def close(self):
+        self.handle.close();
+
+class ArrowWriter:
+    """Appends chunks to a Parquet file as row groups, or to a Feather (Arrow IPC) file as record batches"""
+    def __init__(self, file_name, output):
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError('Saving Parquet or Feather files needs the pyarrow package, pip install pyarrow');
+        self.pa = pyarrow;
+        self.file_name = file_name;
+        self.output = output;
+        self.schema = None;
+        self.writer = None;
+        #file the Feather writer writes to, closing the writer leaves it open
+        self.sink = None;
+
+    def arrow_schema(self, chunk):
+        """Schema from the column types rather than the values, so chunks with only missing values still fit"""
+        pa = self.pa;
+        fields = [];
+        for col in chunk.columns:
+            dtype = chunk[col].dtype;
+            if dtype.kind == 'M':
+                field_type = pa.timestamp('ns');
+            elif dtype.kind in 'iu':
+                field_type = pa.int64();
+            elif dtype.kind == 'f':
+                field_type = pa.float64();
+            elif dtype.kind == 'b':
+                field_type = pa.bool_();
+            else:
+                field_type = pa.string();
+            fields.append(pa.field(str(col), field_type));
+        return pa.schema(fields);
+
+    def write(self, chunk):
+        #categories differ from chunk to chunk, so they are written as plain values
+        chunk = pd.DataFrame({col: chunk[col].astype(object) if isinstance(chunk[col].dtype, pd.CategoricalDtype) else chunk[col] \
+                              for col in chunk.columns});
+        if self.writer is None:
+            self.schema = self.arrow_schema(chunk);
+            if self.output == 'parquet':
+                import pyarrow.parquet
+                self.writer = pyarrow.parquet.ParquetWriter(self.file_name, self.schema);
+            else:
+                self.sink = self.pa.OSFile(self.file_name, 'wb');
+                self.writer = self.pa.ipc.new_file(self.sink, self.schema);
+        self.writer.write_table(self.pa.Table.from_pandas(chunk, schema=self.schema, preserve_index=False));
+
+    def close(self):
+        try:
+            if self.writer is not None:
+                self.writer.close();
+        finally:
+            if self.sink is not None:
+                self.sink.close();
+
+def export_view(view, file_name, progress=no_progress, highlight_columns=False, chunk_rows=EXPORT_ROWS):
+    """Write the rows of a TableView in chunks, with highlight_color and highlight_rule columns when asked"""
+    output, compression = output_format(file_name);
+    partial = file_name + '.part';
+    writer = CsvWriter(partial, compression) if output == 'csv' else ArrowWriter(partial, output);
+    try:
+        #an empty view still writes the column names
+        for start in range(0, max(len(view), 1), chunk_rows):
+            stop = min(start + chunk_rows, len(view));
+            progress(start, len(view), '%d of %d rows saved' % (start, len(view)));
+            chunk = take_rows(view.data, view.rows[start:stop]).reset_index(drop=True);
+            if highlight_columns:
+                chunk['highlight_color'] = view.window_colors(start, stop);
+                chunk['highlight_rule'] = view.window_rules(start, stop);
+            writer.write(chunk);
+        writer.close();
+    except BaseException:
+        #nothing is left behind by a failed or cancelled export
+        writer.close();
+        os.remove(partial);
+        raise;
+    os.replace(partial, file_name);
+    return len(view);
@@ -0,0 +1,270 @@
+"""
+Highlight rule engine for Timeline2GUI
+Parses highlights.txt once and evaluates all rules of a column over its distinct values
+"""
+import re
+import time
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from storage import ChunkedFrame
+from workers import no_progress
+from instrument import timed
+
+COMPARE_TYPES = ('CONTAINS', 'STARTS', 'ENDS', 'EQUALS');
+REGEX_CHARS = set('.^$*+?{}[]|()\\');
+#columns with fewer rows per distinct value than this are checked rule by rule without the combined prepass
+PREPASS_REPEATS = 2;
+#values each rule's piece of the combined pattern is timed on alone, to split the candidate scan time between the rules
+COST_SAMPLE = 1000;
+
+Rule = namedtuple('Rule', ['column', 'compare_type', 'text', 'color']);
+
+def load_rules(file_name="highlights.txt"):
+    """Read highlights.txt and return a compiled RuleSet, None if the file is missing"""
+    try:
+        highlights_file = open(file_name, 'r');
+    except:
+        print("No highlights found!");
+        return None;
+    with highlights_file:
+        return RuleSet.parse(highlights_file);
+
+def is_literal(text):
+    """True when a CONTAINS text has no regular expression syntax, it is then matched as plain text"""
+    return not REGEX_CHARS.intersection(text);
+
+def column_uniques(series):
+    """Factorize a column into row codes (-1 for missing) and its lowercased unique strings,
+    kept as python strings so patterns run on re, Arrow strings would send them to RE2 which rejects some of them"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy();
+        uniques = pd.Series(series.cat.categories).astype(str).astype(object);
+    else:
+        codes, uniques = pd.factorize(series);
+        uniques = pd.Series(uniques).astype(str).astype(object);
+    return codes, uniques.str.lower().reset_index(drop=True);
+
+class RuleSet:
+    """Compiled highlight rules, in file order - later rules take precedence like setRowColors"""
+    def __init__(self, rules):
+        self.rules = list(rules);
+        self.palette = [];
+        for rule in self.rules:
+            if rule.color not in self.palette:
+                self.palette.append(rule.color);
+        self.rule_colors = np.array([self.palette.index(rule.color) for rule in self.rules], dtype=np.int16);
+        #rules left out of the combined prepass are matched on their own against every value
+        self.combinable = [self.combinable_rule(rule) for rule in self.rules];
+        combined = '|'.join(self.fragment(rule) for rule, joined in zip(self.rules, self.combinable) if joined);
+        try:
+            re.compile(combined);
+        except re.error as e:
+            print('The highlight rules do not combine into one pattern, each rule is matched on its own: ', e);
+            self.combinable = [False] * len(self.rules);
+        #a parallel.Scanner splits large columns across processes
+        self.scanner = None;
+        #the candidate scan time is split between the rules only while it is logged, the split times every rule again
+        self.share_costs = False;
+
+    @classmethod
+    def parse(cls, lines):
+        """Parse highlight lines of the form column=TYPE=text=color"""
+        rules = [];
+        for row in lines:
+            highlight = row.rstrip('\n').rstrip('\r');
+            if not highlight:#To avoid empty rows
+                continue;
+            highlight_options = highlight.split('=');
+            if len(highlight_options) != 4:
+                print('Please check your settings for highlight option.');
+                print('This is an example of the format: *=CONTAINS=USB=#FF0000,*=ENDS=LNK=#EE0000');
+                continue;
+            column = highlight_options[0].strip();
+            compare_type = highlight_options[1].strip().upper();
+            search_text = highlight_options[2].strip();
+            highlight_color = highlight_options[3].strip();
+            if compare_type not in COMPARE_TYPES:
+                print(compare_type, ' -mentioned in highlights.txt - is not one of', ', '.join(COMPARE_TYPES));
+                continue;
+            if compare_type == 'CONTAINS':
+                #CONTAINS has always been a case insensitive regular expression
+                try:
+                    re.compile(search_text);
+                except re.error:
+                    print(search_text, ' -mentioned in highlights.txt - is not a valid pattern, matching it literally');
+                    search_text = re.escape(search_text);
+            rules.append(Rule(column, compare_type, search_text, highlight_color));
+        return cls(rules);
+
+    def __len__(self):
+        return len(self.rules);
+
+    @staticmethod
+    def combinable_rule(rule):
+        """True when the rule can join the combined pattern, groups, backreferences and global inline flags
+        like (?i) change meaning or fail once several patterns are joined"""
+        if rule.compare_type != 'CONTAINS' or is_literal(rule.text):
+            return True;
+        try:
+            pattern = re.compile(rule.text);
+        except re.error:
+            return False;
+        return pattern.groups == 0 and not pattern.flags & ~re.UNICODE;
+
+    def names(self):
+        """Each rule as written in highlights.txt, without its color"""
+        return ['='.join([rule.column, rule.compare_type, rule.text]) for rule in self.rules];
+
+    def columns_for(self, columns):
+        """Map each column to the indexes of the rules that apply to it"""
+        rules_by_column = {};
+        for column in dict.fromkeys(rule.column for rule in self.rules):
+            if column != '*' and column not in columns:
+                print(column, ' -mentioned in highlights.txt - does not exist');
+        for col in columns:
+            applicable = [i for i, rule in enumerate(self.rules) if rule.column in ('*', col)];
+            if applicable:
+                rules_by_column[col] = applicable;
+        return rules_by_column;
+
+    def evaluate(self, data, progress=no_progress, rows=None):
+        """Evaluate all rules over a DataFrame, or the given row positions of it, and return a HighlightResult"""
+        if isinstance(data, ChunkedFrame):
+            return self.evaluate_chunks(data, progress, rows);
+        count = len(data) if rows is None else len(rows);
+        rule_index = np.full(count, -1, dtype=np.int32);
+        hits = np.zeros(len(self.rules), dtype=np.int64);
+        seconds = np.zeros(len(self.rules));
+        star_masks = {i: np.zeros(count, dtype=bool) for i, rule in enumerate(self.rules) if rule.column == '*'};
+        rules_by_column = self.columns_for(data.columns);
+        for done, (col, applicable) in enumerate(rules_by_column.items()):
+            progress(done, len(rules_by_column), 'highlighting ' + str(col));
+            with timed('unique values'):
+                codes, uniques = column_uniques(data[col] if rows is None else data[col].iloc[rows]);
+            #on mostly unique columns the combined pattern costs more than the rules it saves
+            prepass = len(uniques) * PREPASS_REPEATS <= len(codes);
+            best, matched = self.match_uniques(uniques, applicable, seconds, prepass);
+            #one gather maps the per-unique winner back to every row, code -1 hits the sentinel
+            rule_index = np.maximum(rule_index, np.append(best, -1)[codes]);
+            counts = np.bincount(codes[codes >= 0], minlength=len(uniques));
+            for i, unique_mask in matched.items():
+                if i in star_masks:
+                    star_masks[i] |= np.append(unique_mask, False)[codes];
+                else:
+                    hits[i] += counts[unique_mask].sum();
+        for i, mask in star_masks.items():
+            hits[i] = mask.sum();
+        return HighlightResult(rule_index, self.rule_colors, self.palette, hits, seconds);
+
+    def evaluate_chunks(self, data, progress=no_progress, rows=None):
+        """evaluate for an out-of-core timeline, one chunk at a time"""
+        rule_index = np.full(len(data) if rows is None else len(rows), -1, dtype=np.int32);
+        hits = np.zeros(len(self.rules), dtype=np.int64);
+        seconds = np.zeros(len(self.rules));
+        for done, (frame, local, where) in enumerate(data.split(rows)):
+            progress(done, data.chunk_count, 'highlighting chunk %d of %d' % (done + 1, data.chunk_count));
+            result = self.evaluate(frame, no_progress, local);
+            rule_index[where] = result.rule_index;
+            #rows of different chunks are distinct, so the per chunk counts add up, * rules included
+            hits += result.hits;
+            seconds += result.seconds;
+        return HighlightResult(rule_index, self.rule_colors, self.palette, hits, seconds);
+
+    def match_uniques(self, uniques, applicable, seconds=None, prepass=True):
+        """Run the combined pattern once, then resolve the winning rule on the candidates only,
+        without the prepass every rule checks every value, the time each rule takes is added to seconds when given"""
+        best = np.full(len(uniques), -1, dtype=np.int32);
+        matched = {};
+        if len(uniques) == 0:
+            return best, matched;
+        if self.scanner is not None and self.scanner.worth(len(uniques)):
+            return self.scanner.match_uniques(self.rules, uniques, applicable, seconds, prepass, self.share_costs);
+        every = np.arange(len(uniques));
+        candidates, subset = every, uniques;
+        joined = set(i for i in applicable if self.combinable[i]) if prepass else set();
+        if joined:
+            combined = '|'.join(self.fragment(self.rules[i]) for i in applicable if i in joined);
+            start = time.perf_counter();
+            with timed('candidate scan'):
+                candidates = np.flatnonzero(uniques.str.contains(combined, regex=True, na=False).to_numpy());
+            if seconds is not None and self.share_costs:
+                self.share_scan(uniques, [i for i in applicable if i in joined], time.perf_counter() - start, seconds);
+            subset = uniques.iloc[candidates];
+        for i in applicable:
+            #rules outside the combined pattern check every value
+            positions, values = (candidates, subset) if i in joined else (every, uniques);
+            start = time.perf_counter();
+            rule_mask = self.compare(values, self.rules[i]);
+            if seconds is not None:
+                seconds[i] += time.perf_counter() - start;
+            best[positions[rule_mask]] = i;
+            unique_mask = np.zeros(len(uniques), dtype=bool);
+            unique_mask[positions[rule_mask]] = True;
+            matched[i] = unique_mask;
+        return best, matched;
+
+    def share_scan(self, uniques, applicable, scan_seconds, seconds):
+        """Add the time of the combined candidate scan to the rules in it, in proportion to the time
+        each rule's piece of the pattern takes alone on an evenly spread sample of the values"""
+        sample = uniques.iloc[np.linspace(0, len(uniques) - 1, min(COST_SAMPLE, len(uniques))).astype(np.int64)];
+        weights = [];
+        for i in applicable:
+            start = time.perf_counter();
+            sample.str.contains(self.fragment(self.rules[i]), regex=True, na=False);
+            weights.append(time.perf_counter() - start);
+        total = sum(weights);
+        for i, weight in zip(applicable, weights):
+            seconds[i] += scan_seconds * (weight / total if total > 0 else 1.0 / len(applicable));
+
+    @staticmethod
+    def fragment(rule):
+        """Regular expression piece of a rule for the combined candidate scan of lowercased values,
+        only CONTAINS patterns need to ignore case"""
+        text = rule.text.lower();
+        if rule.compare_type == 'CONTAINS':
+            return re.escape(text) if is_literal(rule.text) else '(?i:' + rule.text + ')';
+        elif rule.compare_type == 'STARTS':
+            return '^' + re.escape(text);
+        elif rule.compare_type == 'ENDS':
+            return re.escape(text) + r'\Z';
+        return '^' + re.escape(text) + r'\Z';
+
+    @staticmethod
+    def compare(values, rule):
+        """Performs the kind of string compare as configured in highlights.txt on lowercased values"""
+        text = rule.text.lower();
+        if rule.compare_type == 'ENDS':
+            mask = values.str.endswith(text, na=False);
+        elif rule.compare_type == 'STARTS':
+            mask = values.str.startswith(text, na=False);
+        elif rule.compare_type == 'EQUALS':
+            mask = values == text;
+        elif is_literal(rule.text):
+            mask = values.str.contains(text, regex=False, na=False);
+        else:
+            mask = values.str.contains(rule.text, flags=re.IGNORECASE, regex=True, na=False);
+        return mask.to_numpy(dtype=bool);
+
+class HighlightResult:
+    """Per-row winning rule and color code of a RuleSet evaluation, with the hits and seconds of each rule"""
+    def __init__(self, rule_index, rule_colors, palette, hits, seconds=None):
+        self.rule_index = rule_index;
+        self.palette = palette;
+        self.hits = hits;
+        self.seconds = np.zeros(len(hits)) if seconds is None else seconds;
+        self.color_codes = np.where(rule_index >= 0, rule_colors[np.maximum(rule_index, 0)], -1).astype(np.int16) \
+            if len(rule_colors) else np.full(len(rule_index), -1, dtype=np.int16);
+        self.rule_colors = rule_colors;
+
+    def __len__(self):
+        return len(self.rule_index);
+
+    def extend(self, other):
+        """Result for the rows of this evaluation followed by those of other, as when rows are appended"""
+        return HighlightResult(np.concatenate([self.rule_index, other.rule_index]), self.rule_colors, self.palette, \
+                               self.hits + other.hits, self.seconds + other.seconds);
+
+    def rows(self):
+        """Positions of the highlighted rows, i.e. the reduced view"""
+        return np.flatnonzero(self.rule_index >= 0);
@@ -0,0 +1,612 @@
+"""
+Indexes over a loaded timeline
+TrigramIndex answers substring searches on the text columns without scanning every row
+FilterIndex answers date ranges and categorical comparisons of a filter query
+ResultCache keeps the rows of recent filters and searches to refine them incrementally
+"""
+import ast
+import json
+import operator
+import os
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from highlighter import column_uniques
+from storage import ChunkedFrame
+from workers import no_progress
+
+#characters that make a search value a regular expression rather than a plain substring
+REGEX_CHARACTERS = set('^$*+?{}[]\\|()');
+#text indexed at a time, the (trigram, value) pairs of one batch are sorted in memory
+BATCH_BYTES = 1 << 20;
+TRIGRAMS = 1 << 24;
+
+def sorted_runs(values):
+    """(distinct values, count of each) of a sorted array"""
+    if len(values) == 0:
+        return values, np.zeros(0, dtype=np.int64);
+    starts = np.flatnonzero(np.concatenate([[True], values[1:] != values[:-1]]));
+    return values[starts], np.diff(np.append(starts, len(values)));
+
+def trigrams(text):
+    """Sorted distinct 24 bit trigram codes of the utf-8 bytes of a string"""
+    data = np.frombuffer(text.encode('utf-8', 'surrogatepass'), dtype=np.uint8).astype(np.int32);
+    if len(data) < 3:
+        return np.zeros(0, dtype=np.int32);
+    return np.unique((data[:-2] << 16) | (data[1:-1] << 8) | data[2:]);
+
+def required_fragments(term):
+    """Literal pieces every match of a search value must contain, None when the index cannot help"""
+    if any(c in REGEX_CHARACTERS for c in term):
+        return None;
+    #'.' matches any character, so only the text between dots is known
+    fragments = [fragment for fragment in term.lower().split('.') if len(fragment.encode('utf-8', 'surrogatepass')) >= 3];
+    return fragments or None;
+
+def scan_column(series, term, scanner=None):
+    """Rows of a column that contain the (lowercased, regex) search value, tested once per unique value"""
+    codes, uniques = column_uniques(series);
+    if scanner is not None and scanner.worth(len(uniques)):
+        matched = scanner.contains(uniques, term);
+    else:
+        matched = uniques.str.contains(term, na=False, regex=True).to_numpy(dtype=bool);
+    return np.append(matched, False)[codes];
+
+def search_mask(data, term, rows, index=None, progress=no_progress, scanner=None):
+    """Which of the row positions of data have a column containing the search value"""
+    if isinstance(data, ChunkedFrame):
+        return chunked_search_mask(data, term, rows, progress, scanner);
+    term = term.lower();
+    fragments = required_fragments(term);
+    mask = np.zeros(len(rows), dtype=bool);
+    every_row = len(rows) == len(data);
+    columns = list(data.columns);
+    for done, col in enumerate(columns):
+        progress(done, len(columns), '%d of %d columns scanned' % (done, len(columns)));
+        if index is not None and fragments and index.has(col):
+            hits = np.zeros(index.rows, dtype=bool);
+            hits[index.search(col, term, fragments)] = True;
+            mask |= hits[rows];
+        elif every_row:
+            mask |= scan_column(data[col], term, scanner)[rows];
+        else:
+            mask |= scan_column(data[col].iloc[rows], term, scanner);
+    return mask;
+
+def chunked_search_mask(data, term, rows, progress=no_progress, scanner=None):
+    """search_mask of an out-of-core timeline, scanning one chunk at a time"""
+    mask = np.zeros(len(rows), dtype=bool);
+    for done, (frame, local, where) in enumerate(data.split(rows)):
+        progress(done, data.chunk_count, 'searching chunk %d of %d' % (done + 1, data.chunk_count));
+        mask[where] = search_mask(frame, term, local, None, no_progress, scanner);
+    return mask;
+
+class ColumnIndex:
+    """Trigram posting lists over the unique values of one column, plus the rows of each unique value"""
+    def __init__(self, keys, offsets, uids, order, starts):
+        self.keys = keys;
+        self.offsets = offsets;
+        self.uids = uids;
+        self.order = order;
+        self.starts = starts;
+
+    @classmethod
+    def build(cls, series, progress=no_progress):
+        codes, uniques = column_uniques(series);
+        #rows grouped by unique value, rows of unique u are order[starts[u]:starts[u + 1]]
+        order = np.argsort(codes, kind='stable');
+        starts = np.searchsorted(codes[order], np.arange(len(uniques) + 1));
+        uniques = uniques.str.replace('\x00', ' ', regex=False).tolist();
+        #pairs are kept per batch as int32 trigrams and unique ids, sorted by trigram then id
+        batches = [];
+        seen = np.zeros(TRIGRAMS, dtype=bool);
+        batch_start = 0;
+        while batch_start < len(uniques):
+            progress(batch_start, len(uniques), 'indexing ' + str(series.name));
+            batch_end = batch_start;
+            size = 0;
+            while batch_end < len(uniques) and size < BATCH_BYTES:
+                size += len(uniques[batch_end]) + 1;
+                batch_end += 1;
+            grams, uids = cls.batch_pairs(uniques[batch_start:batch_end], batch_start);
+            seen[grams] = True;
+            batches.append((grams, uids));
+            batch_start = batch_end;
+        keys = np.flatnonzero(seen).astype(np.int32);
+        del seen;
+        #counting sort: the length of every posting list first, then each batch is written at the end of its lists
+        counts = np.zeros(len(keys), dtype=np.int64);
+        for grams, _ in batches:
+            slots, slot_counts = sorted_runs(np.searchsorted(keys, grams));
+            counts[slots] += slot_counts;
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64);
+        cursor = offsets[:-1].copy();
+        postings = np.empty(int(offsets[-1]), dtype=np.int32);
+        while batches:
+            #batches are in id order, so every posting list ends up sorted
+            grams, uids = batches.pop(0);
+            slots = np.searchsorted(keys, grams);
+            rank = np.arange(len(grams)) - np.searchsorted(grams, grams, 'left');
+            postings[cursor[slots] + rank] = uids;
+            slots, slot_counts = sorted_runs(slots);
+            cursor[slots] += slot_counts;
+        return cls(keys, offsets, postings, order, starts);
+
+    @staticmethod
+    def batch_pairs(values, first_uid):
+        """Distinct (trigram, unique id) pairs of a batch of NUL separated values as two int32 arrays, by trigram then id"""
+        data = np.frombuffer('\x00'.join(values).encode('utf-8', 'surrogatepass'), dtype=np.uint8);
+        if len(data) < 3:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32);
+        owner = np.cumsum(data == 0)[:-2].astype(np.int64);
+        wide = data.astype(np.int64);
+        grams = (wide[:-2] << 16) | (wide[1:-1] << 8) | wide[2:];
+        inside = (data[:-2] != 0) & (data[1:-1] != 0) & (data[2:] != 0);
+        #ids within the batch fit in 32 bits next to a 24 bit trigram
+        #sorted then deduplicated, np.unique hashes large integer arrays much more slowly
+        pairs = np.sort((grams[inside] << 32) | owner[inside]);
+        pairs = sorted_runs(pairs)[0];
+        return (pairs >> 32).astype(np.int32), (pairs & 0xffffffff).astype(np.int32) + np.int32(first_uid);
+
+    def postings(self, gram):
+        """Sorted unique ids whose value contains a trigram"""
+        position = np.searchsorted(self.keys, gram);
+        if position >= len(self.keys) or self.keys[position] != gram:
+            return np.zeros(0, dtype=np.int32);
+        return self.uids[self.offsets[position]:self.offsets[position + 1]];
+
+    def candidate_rows(self, fragments):
+        """Rows holding every trigram of every fragment"""
+        grams = np.unique(np.concatenate([trigrams(fragment) for fragment in fragments]));
+        candidates = None;
+        #shortest posting lists first keeps the intersections small
+        for postings in sorted((self.postings(gram) for gram in grams), key=len):
+            candidates = postings if candidates is None else np.intersect1d(candidates, postings, assume_unique=True);
+            if len(candidates) == 0:
+                break;
+        lengths = self.starts[candidates + 1] - self.starts[candidates];
+        #concatenate order[starts[u]:starts[u + 1]] for every candidate u without a python loop
+        positions = np.repeat(self.starts[candidates] - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum());
+        return np.sort(self.order[positions]);
+
+class TrigramIndex:
+    """Inverted trigram index over the text columns of a frame"""
+    def __init__(self, rows, columns):
+        self.rows = rows;
+        self.columns = columns;
+        self.data = None;
+
+    def has(self, col):
+        return col in self.columns;
+
+    @staticmethod
+    def estimate_bytes(data, columns):
+        """Upper bound of the size of the index of these columns, a posting per byte of every distinct value"""
+        size = 0;
+        for col in columns:
+            if col in data.columns:
+                _, uniques = column_uniques(data[col]);
+                size += 4 * int(uniques.str.len().sum()) + 16 * len(data);
+        return size;
+
+    @classmethod
+    def build(cls, data, columns, progress=no_progress):
+        """Index the given columns of data, columns not in data are skipped"""
+        index = cls(len(data), {});
+        for col in columns:
+            if col in data.columns:
+                index.columns[col] = ColumnIndex.build(data[col], progress);
+        index.data = data;
+        return index;
+
+    def search(self, col, term, fragments):
+        """Rows of the indexed frame whose column matches the lowercased search value"""
+        candidates = self.columns[col].candidate_rows(fragments);
+        if len(candidates) == 0:
+            return candidates;
+        #posting lists only prove the trigrams are present, the candidates are checked like a scan
+        values = self.data[col].iloc[candidates].astype(str).astype(object).str.lower();
+        return candidates[values.str.contains(term, na=False, regex=True).to_numpy(dtype=bool)];
+
+    def save(self, directory):
+        """Write the index as .npy files next to the cached data"""
+        os.makedirs(directory, exist_ok=True);
+        names = [];
+        for i, (col, column_index) in enumerate(self.columns.items()):
+            for part in ('keys', 'offsets', 'uids', 'order', 'starts'):
+                np.save(os.path.join(directory, 'i%d.%s.npy' % (i, part)), getattr(column_index, part));
+            names.append(col);
+        with open(os.path.join(directory, 'index.json'), 'w') as manifest_file:
+            json.dump({'rows': self.rows, 'columns': names}, manifest_file);
+
+    @classmethod
+    def load(cls, directory, data):
+        """Memory map a saved index, None when there is none for this data"""
+        try:
+            with open(os.path.join(directory, 'index.json'), 'r') as manifest_file:
+                manifest = json.load(manifest_file);
+        except (OSError, ValueError):
+            return None;
+        if manifest['rows'] != len(data):
+            return None;
+        index = cls(len(data), {});
+        for i, col in enumerate(manifest['columns']):
+            parts = [np.load(os.path.join(directory, 'i%d.%s.npy' % (i, part)), mmap_mode='r') \
+                     for part in ('keys', 'offsets', 'uids', 'order', 'starts')];
+            index.columns[col] = ColumnIndex(*parts);
+        index.data = data;
+        return index;
+
+NAT = np.iinfo(np.int64).min;
+COMPARISONS = {ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>=', ast.Eq: '=='};
+#a constant on the left, 'x' < date, is the same as date > 'x'
+FLIPPED = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '==': '=='};
+OPERATORS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge};
+
+def query_frame(data, expression):
+    """Positions of DataFrame.query, retried with the categorical columns it names as plain values,
+    as pandas compares unordered categoricals for equality only"""
+    try:
+        return data.query(expression).index.to_numpy();
+    except TypeError:
+        names = {node.id for node in ast.walk(ast.parse(expression.strip(), mode='eval')) if isinstance(node, ast.Name)};
+        plain = {col: data[col].astype(object) for col in names \
+                 if col in data.columns and isinstance(data[col].dtype, pd.CategoricalDtype)};
+        if not plain:
+            raise;
+        return data.assign(**plain).query(expression).index.to_numpy();
+
+class TimeIndex:
+    """Row positions sorted by a datetime64 column, NaT rows left out as no comparison matches them"""
+    def __init__(self, values):
+        values = np.asarray(values, dtype='datetime64[ns]').view(np.int64);
+        valid = np.flatnonzero(values != NAT);
+        self.order = valid[np.argsort(values[valid], kind='stable')];
+        self.sorted = values[self.order];
+
+    def compare(self, op, value):
+        """Rows where column op value, by binary search"""
+        value = pd.Timestamp(value).to_datetime64().astype('datetime64[ns]').view(np.int64);
+        if op == '<':
+            return self.order[:np.searchsorted(self.sorted, value, 'left')];
+        elif op == '<=':
+            return self.order[:np.searchsorted(self.sorted, value, 'right')];
+        elif op == '>':
+            return self.order[np.searchsorted(self.sorted, value, 'right'):];
+        elif op == '>=':
+            return self.order[np.searchsorted(self.sorted, value, 'left'):];
+        return self.order[np.searchsorted(self.sorted, value, 'left'):np.searchsorted(self.sorted, value, 'right')];
+
+class ValueIndex:
+    """Row positions of every value of a categorical column"""
+    def __init__(self, series):
+        codes = series.cat.codes.to_numpy();
+        self.categories = {value: code for code, value in enumerate(series.cat.categories)};
+        self.order = np.argsort(codes, kind='stable');
+        self.starts = np.searchsorted(codes[self.order], np.arange(len(self.categories) + 1));
+
+    def rows(self, value):
+        code = self.categories.get(value);
+        if code is None:
+            return np.zeros(0, dtype=np.int64);
+        return self.order[self.starts[code]:self.starts[code + 1]];
+
+    def compare(self, op, value):
+        """Rows where column op value for a range operator, each category is compared as a plain value,
+        raises TypeError when the value does not compare with the categories"""
+        compare = OPERATORS[op];
+        codes = [code for category, code in self.categories.items() if compare(category, value)];
+        return np.concatenate([self.order[self.starts[code]:self.starts[code + 1]] for code in codes] \
+                              or [np.zeros(0, dtype=np.int64)]);
+
+class TimeColumn:
+    """TimeIndex answered by comparing every row, for data queried only once"""
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype='datetime64[ns]').view(np.int64);
+
+    def compare(self, op, value):
+        value = pd.Timestamp(value).to_datetime64().astype('datetime64[ns]').view(np.int64);
+        return np.flatnonzero(OPERATORS.get(op, operator.eq)(self.values, value) & (self.values != NAT));
+
+class ValueColumn:
+    """ValueIndex answered by comparing the codes of every row, for data queried only once"""
+    def __init__(self, series):
+        self.codes = series.cat.codes.to_numpy();
+        self.categories = {value: code for code, value in enumerate(series.cat.categories)};
+
+    def rows(self, value):
+        code = self.categories.get(value);
+        if code is None:
+            return np.zeros(0, dtype=np.int64);
+        return np.flatnonzero(self.codes == code);
+
+    def compare(self, op, value):
+        compare = OPERATORS[op];
+        return np.flatnonzero(np.isin(self.codes, [code for category, code in self.categories.items() if compare(category, value)]));
+
+class FilterIndex:
+    """Answers date range and categorical equality predicates of a query without scanning the frame"""
+    time_index_type = TimeIndex;
+    value_index_type = ValueIndex;
+
+    def __init__(self, data, time_column='date'):
+        self.data = data;
+        self.time_column = time_column;
+        self.time_index = None;
+        if time_column in data.columns and data[time_column].dtype.kind == 'M':
+            self.time_index = self.time_index_type(data[time_column]);
+        self.value_indexes = {};
+
+    def value_index(self, col):
+        """Value index of a categorical column, built on first use, None for other columns"""
+        if col not in self.value_indexes:
+            is_category = col in self.data.columns and isinstance(self.data[col].dtype, pd.CategoricalDtype);
+            self.value_indexes[col] = self.value_index_type(self.data[col]) if is_category else None;
+        return self.value_indexes[col];
+
+    def rows_mask(self, rows):
+        mask = np.zeros(len(self.data), dtype=bool);
+        mask[rows] = True;
+        return mask;
+
+    def predicate(self, node):
+        """Row mask of a conjunct the indexes can answer, None when it has to go to DataFrame.query"""
+        if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.Or):
+            masks = [self.predicate(value) for value in node.values];
+            if any(mask is None for mask in masks):
+                return None;
+            return np.logical_or.reduce(masks);
+        if not isinstance(node, ast.Compare):
+            return None;
+        masks = [];
+        left = node.left;
+        for op, right in zip(node.ops, node.comparators):
+            mask = self.comparison(left, op, right);
+            if mask is None:
+                return None;
+            masks.append(mask);
+            left = right;
+        return np.logical_and.reduce(masks);
+
+    def comparison(self, left, op, right):
+        """Row mask of a single column/constant comparison"""
+        if isinstance(op, ast.In) and isinstance(left, ast.Name) and isinstance(right, (ast.List, ast.Tuple)):
+            index = self.value_index(left.id);
+            if index is None or not all(isinstance(item, ast.Constant) for item in right.elts):
+                return None;
+            return self.rows_mask(np.concatenate([index.rows(item.value) for item in right.elts] or [np.zeros(0, dtype=np.int64)]));
+        if type(op) not in COMPARISONS:
+            return None;
+        op = COMPARISONS[type(op)];
+        if isinstance(left, ast.Constant) and isinstance(right, ast.Name):
+            left, right, op = right, left, FLIPPED[op];
+        if not (isinstance(left, ast.Name) and isinstance(right, ast.Constant)):
+            return None;
+        if left.id == self.time_column and self.time_index is not None and isinstance(right.value, str):
+            try:
+                return self.rows_mask(self.time_index.compare(op, right.value));
+            except ValueError:
+                return None;
+        index = self.value_index(left.id);
+        if index is None:
+            return None;
+        if op == '==':
+            return self.rows_mask(index.rows(right.value));
+        #DataFrame.query only compares unordered categoricals for equality, ranges are answered here
+        try:
+            return self.rows_mask(index.compare(op, right.value));
+        except TypeError:
+            return None;
+
+    def conjuncts(self, query):
+        """Top level 'and' terms of a query as (normalized key, node, source text), None when it is not Python"""
+        query = query.strip();
+        try:
+            tree = ast.parse(query, mode='eval').body;
+        except SyntaxError:
+            return None;
+        conjuncts = [];
+        pending = [tree];
+        while pending:
+            node = pending.pop(0);
+            if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+                pending = node.values + pending;
+            else:
+                #ast.dump ignores spacing and quote style, so equal terms get equal keys
+                conjuncts.append((ast.dump(node), node, '(' + ast.get_source_segment(query, node) + ')'));
+        return conjuncts;
+
+    def query_terms(self, conjuncts, rows=None, progress=no_progress):
+        """Row positions matching all conjuncts, only rows are considered when given"""
+        mask = None;
+        remaining = [];
+        for _, node, source in conjuncts:
+            node_mask = self.predicate(node);
+            if node_mask is None:
+                remaining.append(source);
+            else:
+                mask = node_mask if mask is None else mask & node_mask;
+        if rows is None:
+            rows = np.arange(len(self.data)) if mask is None else np.flatnonzero(mask);
+        elif mask is not None:
+            rows = rows[mask[rows]];
+        if remaining:
+            #only the terms the indexes cannot answer go to DataFrame.query
+            rows = query_frame(self.data.iloc[rows], ' and '.join(remaining));
+        return rows;
+
+    def query(self, query, rows=None, progress=no_progress):
+        """Row positions of the data matching the query"""
+        conjuncts = self.conjuncts(query);
+        if conjuncts is None:
+            data = self.data if rows is None else self.data.iloc[rows];
+            return query_frame(data, query);
+        return self.query_terms(conjuncts, rows, progress);
+
+class ChunkFilter(FilterIndex):
+    """FilterIndex of one chunk of an out-of-core timeline, queried once, so its columns are compared rather than sorted"""
+    time_index_type = TimeColumn;
+    value_index_type = ValueColumn;
+
+class ChunkedFilterIndex(FilterIndex):
+    """FilterIndex of an out-of-core timeline, each chunk is queried in turn reading only the columns the query names"""
+    def __init__(self, data, time_column='date'):
+        self.data = data;
+        self.time_column = time_column;
+
+    def query_columns(self, nodes):
+        """Columns named in the query terms and the date column"""
+        names = set(node.id for term in nodes for node in ast.walk(term) if isinstance(node, ast.Name));
+        return [col for col in self.data.columns if col in names or col == self.time_column];
+
+    def run(self, rows, progress, chunk_query, columns=None):
+        """Rows matching chunk_query(chunk index, local rows) over the chunks, in the order of rows"""
+        matched = [];
+        keep = None if rows is None else np.zeros(len(rows), dtype=bool);
+        for done, (frame, local, where) in enumerate(self.data.split(rows, columns)):
+            progress(done, self.data.chunk_count, 'filtering chunk %d of %d' % (done + 1, self.data.chunk_count));
+            found = chunk_query(ChunkFilter(frame, self.time_column), local);
+            if rows is None:
+                matched.append(found + where.start);
+            else:
+                keep[where] = np.isin(local, found);
+        if rows is None:
+            return np.concatenate(matched);
+        return rows[keep];
+
+    def query_terms(self, conjuncts, rows=None, progress=no_progress):
+        return self.run(rows, progress, lambda index, local: index.query_terms(conjuncts, local), \
+                        self.query_columns([node for _, node, _ in conjuncts]));
+
+    def query(self, query, rows=None, progress=no_progress):
+        conjuncts = self.conjuncts(query);
+        columns = None if conjuncts is None else self.query_columns([node for _, node, _ in conjuncts]);
+        return self.run(rows, progress, lambda index, local: index.query(query, local), columns);
+
+class ResultCache:
+    """Least recently used cache of view rows keyed by (filter terms, search terms), within a memory budget"""
+    def __init__(self, filter_index, max_bytes):
+        self.filter_index = filter_index;
+        self.max_bytes = max_bytes;
+        self.entries = OrderedDict();
+        #source of every filter term seen, to evaluate terms a cached result does not have yet
+        self.terms = {};
+
+    def get(self, key):
+        """Cached [rows, highlights] of a view, None on a miss"""
+        entry = self.entries.get(key);
+        if entry is not None:
+            self.entries.move_to_end(key);
+        return entry;
+
+    def put(self, key, rows, highlights=None):
+        if self.max_bytes <= 0:
+            return;
+        self.entries[key] = [rows, highlights];
+        self.entries.move_to_end(key);
+        self.evict();
+
+    def set_highlights(self, key, highlights):
+        if key in self.entries:
+            self.entries[key][1] = highlights;
+            self.evict();
+
+    @staticmethod
+    def entry_bytes(entry):
+        rows, highlights = entry;
+        size = rows.nbytes;
+        if highlights is not None:
+            size += highlights.rule_index.nbytes + highlights.color_codes.nbytes;
+        return size;
+
+    def evict(self):
+        total = sum(self.entry_bytes(entry) for entry in self.entries.values());
+        while total > self.max_bytes and len(self.entries) > 1:
+            _, entry = self.entries.popitem(last=False);
+            total -= self.entry_bytes(entry);
+
+    @staticmethod
+    def plain(term):
+        return not any(c in REGEX_CHARACTERS or c == '.' for c in term);
+
+    def covers(self, cached_terms, terms):
+        """True when every row matching terms also matches cached_terms"""
+        #a plain search is implied by any plain search containing it, 'usb' by 'usbstor'
+        return all(term in terms or (self.plain(term) and any(self.plain(t) and term in t for t in terms)) \
+                   for term in cached_terms);
+
+    def nearest(self, key):
+        """Smallest cached result that the view of key refines, as (key, rows)"""
+        filters, searches = key;
+        best = None;
+        for cached_key, (rows, _) in self.entries.items():
+            cached_filters, cached_searches = cached_key;
+            if not isinstance(cached_filters, frozenset) or not cached_filters <= filters:
+                continue;
+            if not self.covers(cached_searches, searches):
+                continue;
+            if best is None or len(rows) < len(best[1]):
+                best = (cached_key, rows);
+        if best is not None:
+            self.entries.move_to_end(best[0]);
+        return best;
+
+    def query(self, query, progress=no_progress):
+        """Key and rows of a filter query, from the cache or evaluated on the nearest cached subset"""
+        conjuncts = self.filter_index.conjuncts(query) if query.strip() else [];
+        if conjuncts is None:
+            #not Python, so it cannot be split: cached as a whole
+            key = (query.strip(), frozenset());
+            entry = self.get(key);
+            rows = self.filter_index.query(query, progress=progress) if entry is None else entry[0];
+            if entry is None:
+                self.put(key, rows);
+            return key, rows;
+        for term_key, node, source in conjuncts:
+            self.terms[term_key] = (term_key, node, source);
+        key = (frozenset(term_key for term_key, _, _ in conjuncts), frozenset());
+        entry = self.get(key);
+        if entry is not None:
+            return key, entry[0];
+        rows = None;
+        nearest = self.nearest(key);
+        if nearest is not None:
+            (cached_filters, _), rows = nearest;
+            conjuncts = [term for term in conjuncts if term[0] not in cached_filters];
+        rows = self.filter_index.query_terms(conjuncts, rows, progress);
+        self.put(key, rows);
+        return key, rows;
+
+    def clear(self):
+        """Forget every result, as when rows were appended to the data"""
+        self.entries.clear();
+
+    def matching(self, key, data, progress=no_progress):
+        """Positions of the rows of another frame, such as appended rows, kept by the filter and search terms of key"""
+        filters, searches = key;
+        index = FilterIndex(data);
+        if isinstance(filters, frozenset):
+            rows = index.query_terms([self.terms[term_key] for term_key in filters]);
+        else:
+            rows = index.query(filters);
+        for term in searches:
+            rows = rows[search_mask(data, term, rows, None, progress)];
+        return rows;
+
+    def search(self, key, rows, term, search):
+        """Key and rows of searching a view, search(rows, term) returns the mask of rows containing term"""
+        filters, searches = key;
+        term = term.lower();
+        key = (filters, searches | {term});
+        entry = self.get(key);
+        if entry is not None:
+            return key, entry[0];
+        remaining = [term];
+        nearest = self.nearest(key) if isinstance(filters, frozenset) else None;
+        if nearest is not None and nearest[0][0] == filters and len(nearest[1]) < len(rows):
+            (_, cached_searches), rows = nearest;
+            remaining = [t for t in key[1] if t not in cached_searches];
+        for search_term in remaining:
+            rows = rows[search(rows, search_term)];
+        self.put(key, rows);
+        return key, rows;
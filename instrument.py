@@ -0,0 +1,139 @@
+"""
+Stage instrumentation
+Times loading, filtering, searching, highlighting and drawing with their memory use, for the status bar and an optional JSON log
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+#rules shown in the status bar, the log has all of them
+STATUS_RULES = 3;
+#stage records of the work running on each thread, parts are added to the innermost one
+local = threading.local();
+
+def peak_memory():
+    """Peak resident memory of this process in bytes, None where the platform cannot tell"""
+    try:
+        import resource
+    except ImportError:
+        return None;
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss;
+    return peak if sys.platform == 'darwin' else peak * 1024;
+
+def current_memory():
+    """Resident memory of this process in bytes, the peak where the platform has no /proc"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE');
+    except (OSError, ValueError, AttributeError):
+        return peak_memory();
+
+def in_megabytes(size):
+    """Bytes as MB rounded to a tenth, None stays None"""
+    return None if size is None else round(size / 1048576, 1);
+
+@contextmanager
+def timed(part):
+    """Adds the time spent in the block to part of the stage running on this thread, does nothing outside a stage"""
+    record = getattr(local, 'record', None);
+    if record is None:
+        yield;
+        return;
+    start = time.perf_counter();
+    try:
+        yield;
+    finally:
+        parts = record['parts'];
+        parts[part] = round(parts.get(part, 0.0) + time.perf_counter() - start, 4);
+
+class Recorder:
+    """Last record of every stage and the cost of every highlight rule, appended as JSON lines to log_file when one is set"""
+    def __init__(self, log_file=''):
+        self.log_file = log_file;
+        self.lock = threading.Lock();
+        self.stages = {};
+        self.rules = [];
+
+    @property
+    def enabled(self):
+        """True while measurements are appended to a log file"""
+        return bool(self.log_file);
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """Record the wall time and memory of the block, the block may set record['rows'], failed blocks are not recorded"""
+        record = {'stage': name, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'rows': rows, 'parts': {}};
+        outer = getattr(local, 'record', None);
+        memory = current_memory();
+        start = time.perf_counter();
+        local.record = record;
+        try:
+            yield record;
+        finally:
+            local.record = outer;
+        after = current_memory();
+        record.update(seconds=round(time.perf_counter() - start, 4), memory_mb=in_megabytes(after), \
+                      memory_delta_mb=None if memory is None or after is None else in_megabytes(after - memory), \
+                      peak_mb=in_megabytes(peak_memory()));
+        with self.lock:
+            self.stages.pop(name, None);
+            self.stages[name] = record;
+        self.write(record);
+
+    def rule_costs(self, names, highlights):
+        """Record the time and hit count of each rule of a highlight evaluation, costliest first"""
+        costs = [{'rule': name, 'seconds': round(float(seconds), 4), 'hits': int(hits)} \
+                 for name, seconds, hits in zip(names, highlights.seconds, highlights.hits)];
+        costs.sort(key=lambda cost: -cost['seconds']);
+        with self.lock:
+            self.rules = costs;
+        self.write({'stage': 'rules', 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'rows': len(highlights), 'rules': costs});
+
+    def write(self, record):
+        """Append one record to the log file"""
+        if not self.log_file:
+            return;
+        try:
+            with self.lock, open(self.log_file, 'a', encoding='utf-8') as log:
+                log.write(json.dumps(record) + '\n');
+        except OSError as e:
+            print('Could not write ', self.log_file, e);
+            self.log_file = '';
+
+    def status(self):
+        """One line for the status bar: the last stages with their time and memory change, then the costliest rules"""
+        with self.lock:
+            stages = list(self.stages.values());
+            rules = self.rules[:STATUS_RULES];
+        texts = [];
+        for record in stages:
+            text = '%s %.2f s' % (record['stage'], record['seconds']);
+            if abs(record['memory_delta_mb'] or 0) >= 1:
+                text += ' %+.0f MB' % record['memory_delta_mb'];
+            texts.append(text);
+        if stages and stages[-1]['memory_mb'] is not None:
+            texts.append('memory %.0f MB' % stages[-1]['memory_mb']);
+        if rules:
+            texts.append('slowest rules ' + ', '.join('%s %.2f s' % (rule['rule'], rule['seconds']) for rule in rules));
+        return ' | '.join(texts);
+
+    def report(self):
+        """Every stage with its parts and every rule, for the details window"""
+        with self.lock:
+            stages = list(self.stages.values());
+            rules = list(self.rules);
+        lines = [];
+        for record in stages:
+            lines.append('%s: %.3f s, %s rows, memory %s MB (%+.1f MB), peak %s MB' % \
+                         (record['stage'], record['seconds'], '-' if record['rows'] is None else record['rows'], \
+                          record['memory_mb'], record['memory_delta_mb'] or 0.0, record['peak_mb']));
+            for part, seconds in record['parts'].items():
+                lines.append('    %s: %.3f s' % (part, seconds));
+        if rules:
+            lines.append('');
+            lines.append('Highlight rules, costliest first:');
+            lines.extend('%.3f s  %d hits  %s' % (rule['seconds'], rule['hits'], rule['rule']) for rule in rules);
+        return '\n'.join(lines);
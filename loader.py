@@ -0,0 +1,227 @@
+"""
+Timeline CSV ingest
+Reads l2t_csv files in chunks with a known schema, repeated values are stored once as categoricals
+"""
+import csv
+import os
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from workers import no_progress
+from instrument import timed
+
+#column order written by log2timeline/psort in the l2t_csv format
+L2T_COLUMNS = ['date', 'time', 'timezone', 'MACB', 'source', 'sourcetype', 'type', 'user', 'host', \
+               'short', 'desc', 'version', 'filename', 'inode', 'notes', 'format', 'extra'];
+#few distinct values repeated on millions of rows
+CATEGORY_COLUMNS = ['timezone', 'MACB', 'source', 'sourcetype', 'type', 'user', 'host', 'format'];
+#read as text like the other schema columns, then converted, so a '-' does not turn the whole column into text
+NUMERIC_COLUMNS = ['version', 'inode'];
+DEFAULT_CHUNK_ROWS = 500000;
+#columns the date column is parsed from
+DATE_COLUMNS = ['date', 'time', 'timezone'];
+#l2t_csv writes MM/DD/YYYY, the others are tried in order when it does not fit
+DATE_FORMATS = ['%m/%d/%Y', '%Y-%m-%d', '%d/%m/%Y', '%Y/%m/%d', '%d.%m.%Y'];
+UTC_NAMES = ['', '-', 'UTC', 'GMT', 'Z', 'ETC/UTC', 'ETC/GMT'];
+NAT = np.iinfo(np.int64).min;
+#pandas 2 takes the format of the first value for all of them unless told they are mixed, older versions infer each value
+MIXED_FORMATS = {'format': 'mixed'} if int(pd.__version__.split('.')[0]) >= 2 else {};
+#bytes read at a time when looking backwards for the end of the last complete line
+TAIL_BLOCK = 1 << 16;
+
+def to_numeric_column(values):
+    """Convert a column like inode to nullable integers, '-' means missing, keep text if anything else is not a number"""
+    try:
+        return pd.to_numeric(values.replace('-', np.nan)).astype('Int64');
+    except (ValueError, TypeError):
+        return values;
+
+def gather(values, codes):
+    """values[codes] where code -1 (missing) gives NaT"""
+    return np.append(values, NAT)[codes];
+
+class DateParser:
+    """Parses date and time columns through their unique values, the date format is detected once"""
+    def __init__(self):
+        self.date_format = None;
+        self.bad_timezones = set();
+
+    def detect_format(self, dates):
+        """Format of DATE_FORMATS that parses most of a sample of the unique dates, earlier ones win ties"""
+        sample = pd.Series(dates[:1000], dtype=object);
+        parsed = [pd.to_datetime(sample, format=date_format, errors='coerce').notna().sum() for date_format in DATE_FORMATS];
+        if max(parsed) == 0:
+            return None;
+        return DATE_FORMATS[int(np.argmax(parsed))];
+
+    def parse(self, dates, times, timezones=None):
+        """datetime64 column from date and time columns, converted to UTC using the timezone column"""
+        date_codes, date_uniques = pd.factorize(dates);
+        time_codes, time_uniques = pd.factorize(times);
+        if self.date_format is None and len(date_uniques):
+            self.date_format = self.detect_format(date_uniques);
+            print('Date format : ', self.date_format);
+        days = pd.to_datetime(date_uniques, format=self.date_format, errors='coerce');
+        days = np.asarray(days, dtype='datetime64[ns]').view(np.int64);
+        seconds = pd.to_timedelta(pd.Series(time_uniques, dtype=object), errors='coerce');
+        seconds = np.asarray(seconds, dtype='timedelta64[ns]').view(np.int64);
+        #integer arithmetic on the per-unique values, no concatenated string column
+        day_values = gather(days, date_codes);
+        time_values = gather(seconds, time_codes);
+        values = day_values + time_values;
+        failed = (day_values == NAT) | (time_values == NAT);
+        values[failed] = NAT;
+        retry = np.flatnonzero(failed & (date_codes >= 0) & (time_codes >= 0));
+        if len(retry):
+            #only rows the fixed formats could not read fall back to inference
+            text = pd.Series(np.asarray(dates, dtype=object)[retry]) + ' ' + pd.Series(np.asarray(times, dtype=object)[retry]);
+            values[retry] = np.asarray(pd.to_datetime(text, errors='coerce', **MIXED_FORMATS), dtype='datetime64[ns]').view(np.int64);
+        if timezones is not None:
+            self.to_utc(values, timezones);
+        return pd.Series(values.view('datetime64[ns]'), index=getattr(dates, 'index', None));
+
+    def to_utc(self, values, timezones):
+        """Convert local times to UTC in place, one block per distinct timezone"""
+        tz_codes, tz_uniques = pd.factorize(timezones);
+        for code, tz in enumerate(tz_uniques):
+            if str(tz).strip().upper() in UTC_NAMES or tz in self.bad_timezones:
+                continue;
+            rows = np.flatnonzero(tz_codes == code);
+            local = pd.DatetimeIndex(values[rows].view('datetime64[ns]'));
+            try:
+                #times repeated when clocks go back are taken as daylight time, skipped ones are moved forward
+                utc = local.tz_localize(str(tz).strip(), ambiguous=np.ones(len(local), dtype=bool), \
+                                        nonexistent='shift_forward').tz_convert('UTC').tz_localize(None);
+            except Exception as e:
+                print(tz, ' -timezone is not recognised, times are left as they are', e);
+                self.bad_timezones.add(tz);
+                continue;
+            values[rows] = np.asarray(utc, dtype='datetime64[ns]').view(np.int64);
+
+def prepare_chunk(chunk, date_parser):
+    """Merge date and time to one column and convert the schema columns of a chunk"""
+    with timed('date parsing'):
+        chunk['date'] = date_parser.parse(chunk['date'], chunk['time'], chunk['timezone'] if 'timezone' in chunk.columns else None);
+    chunk = chunk.drop(['time'], axis=1);
+    with timed('column types'):
+        for col in CATEGORY_COLUMNS:
+            if col in chunk.columns:
+                chunk[col] = chunk[col].astype('category');
+        for col in NUMERIC_COLUMNS:
+            if col in chunk.columns:
+                chunk[col] = to_numeric_column(chunk[col]);
+    return chunk;
+
+def parse_chunks(source, size, chunk_rows, date_parser, progress=no_progress, names=None):
+    """Yield prepared chunks read from an open binary file, names are given when there is no header line"""
+    rows = 0;
+    #schema columns are read as text, anything else is left to pandas to infer
+    reader = pd.read_csv(source, dtype={col: str for col in L2T_COLUMNS}, chunksize=chunk_rows, \
+                         header='infer' if names is None else None, names=names);
+    while True:
+        #the time spent in the CSV reader is told apart from date parsing and type conversion
+        with timed('csv parsing'):
+            chunk = next(reader, None);
+        if chunk is None:
+            break;
+        rows += len(chunk);
+        progress(source.tell(), size, '%d rows parsed' % rows);
+        yield prepare_chunk(chunk, date_parser);
+
+def read_chunks(file_name, chunk_rows=DEFAULT_CHUNK_ROWS, progress=no_progress):
+    """Yield prepared chunks of a timeline CSV, progress is reported in bytes read"""
+    size = os.path.getsize(file_name);
+    with open(file_name, 'rb') as source:
+        yield from parse_chunks(source, size, chunk_rows, DateParser(), progress);
+
+def read_dates(file_name, chunk_rows=DEFAULT_CHUNK_ROWS, progress=no_progress):
+    """Yield the date column of a timeline CSV a chunk at a time, the other columns are not parsed"""
+    size = os.path.getsize(file_name);
+    date_parser = DateParser();
+    rows = 0;
+    with open(file_name, 'rb') as source:
+        for chunk in pd.read_csv(source, dtype=str, usecols=lambda col: col in DATE_COLUMNS, chunksize=chunk_rows):
+            rows += len(chunk);
+            progress(source.tell(), size, '%d dates read' % rows);
+            yield date_parser.parse(chunk['date'], chunk['time'], chunk['timezone'] if 'timezone' in chunk.columns else None);
+
+class BoundedReader:
+    """Binary file reader ending at a byte offset, so pandas stops before a partly written last line"""
+    def __init__(self, source, stop):
+        self.source = source;
+        self.stop = stop;
+
+    def read(self, size=-1):
+        left = max(self.stop - self.source.tell(), 0);
+        return self.source.read(left if size is None or size < 0 else min(size, left));
+
+    def tell(self):
+        return self.source.tell();
+
+def complete_size(source, start, size):
+    """Offset just past the last newline between start and size, start when there is none"""
+    end = size;
+    while end > start:
+        block_start = max(start, end - TAIL_BLOCK);
+        source.seek(block_start);
+        newline = source.read(end - block_start).rfind(b'\n');
+        if newline >= 0:
+            return block_start + newline + 1;
+        end = block_start;
+    return start;
+
+class TailReader:
+    """Reads the lines appended to a timeline CSV since the last read, a partly written last line waits for the next read"""
+    def __init__(self, file_name, chunk_rows=DEFAULT_CHUNK_ROWS):
+        self.file_name = file_name;
+        self.chunk_rows = chunk_rows;
+        #byte offset just past the last complete line read so far
+        self.offset = 0;
+        self.names = None;
+        self.date_parser = DateParser();
+
+    def read(self, progress=no_progress):
+        """Prepared chunks of the new complete lines, empty when nothing was appended"""
+        size = os.path.getsize(self.file_name);
+        if size < self.offset:
+            raise ValueError(self.file_name + ' became shorter, load it again');
+        with open(self.file_name, 'rb') as source:
+            if self.names is None:
+                header = source.readline();
+                if not header.endswith(b'\n'):
+                    return [];
+                self.names = next(csv.reader([header.decode('utf-8-sig', 'replace').rstrip('\r\n')]));
+                self.offset = source.tell();
+            stop = complete_size(source, self.offset, size);
+            if stop <= self.offset:
+                return [];
+            source.seek(self.offset);
+            chunks = list(parse_chunks(BoundedReader(source, stop), stop, self.chunk_rows, self.date_parser, progress, self.names));
+        #only moved once the rows are parsed, a cancelled read is repeated next time
+        self.offset = stop;
+        return chunks;
+
+def concat_chunks(chunks):
+    """Concatenate chunks column by column, freeing each chunk column as soon as it is copied"""
+    if not chunks:
+        return None;
+    columns = list(chunks[0].columns);
+    data = {};
+    for col in columns:
+        parts = [chunk.pop(col) for chunk in chunks];
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            #chunks have their own categories, the union keeps the column categorical and sorted like a single chunk
+            data[col] = pd.Series(union_categoricals(parts, sort_categories=True));
+        else:
+            data[col] = pd.concat(parts, ignore_index=True);
+        del parts;
+    return pd.DataFrame(data, columns=columns);
+
+def read_timeline(file_name, chunk_rows=DEFAULT_CHUNK_ROWS, progress=no_progress):
+    """Read a timeline CSV into a typed DataFrame with a single date column"""
+    chunks = list(read_chunks(file_name, chunk_rows, progress));
+    with timed('concatenating'):
+        data = concat_chunks(chunks);
+    if data is None:
+        raise ValueError(file_name + ' has no rows');
+    return data;
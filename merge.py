@@ -0,0 +1,191 @@
+"""
+Super-timeline merge
+Streams several timeline CSV files into one dataset ordered by date, with a column naming the file of each row
+"""
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from loader import read_chunks, read_dates, concat_chunks, DEFAULT_CHUNK_ROWS
+from workers import no_progress
+
+SOURCE_COLUMN = 'source_file';
+#rows per spilled block, merge buffers are refilled a block at a time
+BLOCK_ROWS = 4096;
+LAST = np.iinfo(np.int64).max;
+
+def date_keys(dates):
+    """Sort keys of a date column, rows without a date go last"""
+    keys = np.asarray(dates, dtype='datetime64[ns]').view(np.int64).copy();
+    keys[keys == np.iinfo(np.int64).min] = LAST;
+    return keys;
+
+def source_labels(file_names):
+    """Shortest end of each path that tells the files apart, like hostA/timeline.csv and hostB/timeline.csv"""
+    paths = [os.path.normpath(os.path.abspath(file_name)).split(os.sep) for file_name in file_names];
+    labels = [];
+    for path in paths:
+        others = [other for other in paths if other != path];
+        depth = 1;
+        while depth < len(path) and any(other[-depth:] == path[-depth:] for other in others):
+            depth += 1;
+        labels.append('/'.join(path[-depth:]));
+    return labels;
+
+def label_chunk(chunk, source):
+    """Add the source_file column naming the file of the rows"""
+    chunk.insert(1, SOURCE_COLUMN, pd.Categorical([source] * len(chunk), categories=[source]));
+    return chunk;
+
+def sorted_rows(file_name, chunk_rows, progress=no_progress):
+    """Row count of a timeline CSV in date order, None as soon as a row is out of order, only the dates are parsed"""
+    rows = 0;
+    last = None;
+    for dates in read_dates(file_name, chunk_rows, progress):
+        keys = date_keys(dates);
+        if len(keys) == 0:
+            continue;
+        if (last is not None and keys[0] < last) or not (keys[1:] >= keys[:-1]).all():
+            return None;
+        last = keys[-1];
+        rows += len(keys);
+    return rows;
+
+def header_columns(file_name):
+    """Columns of the chunks read from a timeline CSV, time is merged into date"""
+    return [col for col in pd.read_csv(file_name, dtype=str, nrows=0).columns if col != 'time'];
+
+class FileRun:
+    """A timeline CSV already in date order, read straight from the file by the merge instead of being spilled"""
+    def __init__(self, file_name, source, rows):
+        self.file_name = file_name;
+        self.source = source;
+        self.rows = rows;
+
+    def read(self, blocks_per_read=1):
+        """Yield the rows of the file, blocks_per_read blocks at a time"""
+        for chunk in read_chunks(self.file_name, blocks_per_read * BLOCK_ROWS):
+            yield label_chunk(chunk, self.source);
+
+class Run:
+    """Rows in date order spilled to disk as pickled blocks, read back one block at a time"""
+    def __init__(self, directory):
+        self.directory = directory;
+        self.blocks = [];
+        self.rows = 0;
+        self.last = None;
+
+    def accepts(self, keys):
+        """True if rows with these sorted keys can be appended without breaking the order"""
+        return self.last is None or len(keys) == 0 or keys[0] >= self.last;
+
+    def append(self, chunk, keys):
+        """Add sorted rows to the end of the run"""
+        for start in range(0, len(chunk), BLOCK_ROWS):
+            block_file = os.path.join(self.directory, '%d.pkl' % len(self.blocks));
+            chunk.iloc[start:start + BLOCK_ROWS].to_pickle(block_file);
+            self.blocks.append(block_file);
+        self.rows += len(chunk);
+        if len(keys):
+            self.last = keys[-1];
+
+    def read(self, blocks_per_read=1):
+        """Yield the rows of the run, blocks_per_read blocks at a time"""
+        for start in range(0, len(self.blocks), blocks_per_read):
+            parts = [pd.read_pickle(block_file) for block_file in self.blocks[start:start + blocks_per_read]];
+            yield parts[0] if len(parts) == 1 else concat_chunks(parts);
+
+def spill_file(file_name, source, directory, columns, chunk_rows, progress):
+    """Read an unsorted file in chunks into runs on disk, a run per stretch of chunks that follow each other in date order"""
+    runs = [];
+    for chunk in read_chunks(file_name, chunk_rows, progress):
+        if columns is not None and list(chunk.columns) != columns:
+            raise ValueError(file_name + ' does not have the same columns as the other files');
+        label_chunk(chunk, source);
+        keys = date_keys(chunk['date']);
+        if len(keys) > 1 and not (keys[1:] >= keys[:-1]).all():
+            #out of order rows are sorted within their chunk, the runs are merged later
+            order = np.argsort(keys, kind='stable');
+            chunk, keys = chunk.iloc[order], keys[order];
+        if not runs or not runs[-1].accepts(keys):
+            run_dir = os.path.join(directory, '%d' % len(os.listdir(directory)));
+            os.makedirs(run_dir);
+            runs.append(Run(run_dir));
+        runs[-1].append(chunk, keys);
+        columns = [col for col in chunk.columns if col != SOURCE_COLUMN];
+    return runs, columns;
+
+def merge_runs(runs, buffer_rows, progress=no_progress, total=None):
+    """k-way merge of date ordered runs, yields blocks of rows in date order, ties keep run order"""
+    blocks_per_read = max(1, buffer_rows // (BLOCK_ROWS * max(len(runs), 1)));
+    streams = [run.read(blocks_per_read) for run in runs];
+    buffers = [next(stream, None) for stream in streams];
+    keys = [None if buffer is None else date_keys(buffer['date']) for buffer in buffers];
+    done = 0;
+    while any(buffer is not None for buffer in buffers):
+        active = [i for i, buffer in enumerate(buffers) if buffer is not None];
+        #every row up to the smallest buffered last date is final, later rows may still come from that run
+        limit = min(keys[i][-1] for i in active);
+        parts = [];
+        part_keys = [];
+        for i in active:
+            count = int(np.searchsorted(keys[i], limit, side='right'));
+            if count == 0:
+                continue;
+            parts.append(buffers[i].iloc[:count]);
+            part_keys.append(keys[i][:count]);
+            if count == len(buffers[i]):
+                buffers[i] = next(streams[i], None);
+                keys[i] = None if buffers[i] is None else date_keys(buffers[i]['date']);
+            else:
+                buffers[i] = buffers[i].iloc[count:];
+                keys[i] = keys[i][count:];
+        order = np.argsort(np.concatenate(part_keys), kind='stable');
+        merged = concat_chunks(parts) if len(parts) > 1 else parts[0].reset_index(drop=True);
+        done += len(merged);
+        progress(done, total, '%d rows merged' % done);
+        yield merged.take(order).reset_index(drop=True);
+
+def merged_blocks(file_names, chunk_rows=DEFAULT_CHUNK_ROWS, progress=no_progress, temp_dir=None):
+    """Yield the rows of timeline CSV files in date order with a source_file column, a merge block at a time,
+    files in date order are read during the merge, the others are sorted into runs on disk first"""
+    sizes = [os.path.getsize(file_name) for file_name in file_names];
+    directory = tempfile.mkdtemp(prefix='merge', dir=temp_dir);
+    try:
+        runs = [];
+        columns = None;
+        for i, (file_name, source) in enumerate(zip(file_names, source_labels(file_names))):
+            offset = sum(sizes[:i]);
+            file_progress = lambda done, total=None, message='': \
+                progress(offset + done, sum(sizes), source + ': ' + message);
+            rows = sorted_rows(file_name, chunk_rows, file_progress);
+            if rows is None:
+                file_runs, columns = spill_file(file_name, source, directory, columns, chunk_rows, file_progress);
+                runs.extend(file_runs);
+                continue;
+            if columns is not None and header_columns(file_name) != columns:
+                raise ValueError(file_name + ' does not have the same columns as the other files');
+            columns = header_columns(file_name);
+            runs.append(FileRun(file_name, source, rows));
+        yield from merge_runs(runs, chunk_rows, progress, sum(run.rows for run in runs));
+    finally:
+        shutil.rmtree(directory, ignore_errors=True);
+
+def merged_chunks(file_names, chunk_rows=DEFAULT_CHUNK_ROWS, progress=no_progress, temp_dir=None):
+    """merged_blocks gathered into chunks of chunk_rows rows, for the out-of-core storage"""
+    pending = [];
+    for block in merged_blocks(file_names, chunk_rows, progress, temp_dir):
+        pending.append(block);
+        if sum(len(part) for part in pending) >= chunk_rows:
+            yield concat_chunks(pending);
+            pending = [];
+    if pending:
+        yield concat_chunks(pending);
+
+def merge_timelines(file_names, chunk_rows=DEFAULT_CHUNK_ROWS, progress=no_progress, temp_dir=None):
+    """Read timeline CSV files into one DataFrame ordered by date with a source_file column"""
+    data = concat_chunks(list(merged_blocks(file_names, chunk_rows, progress, temp_dir)));
+    if data is None:
+        raise ValueError(', '.join(file_names) + ' have no rows');
+    return data;
@@ -0,0 +1,106 @@
+"""
+Multi-core string matching
+Unique values of a column are packed into shared memory and matched in slices by a process pool
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from highlighter import RuleSet
+
+#below this many unique values starting the slices costs more than it saves
+MIN_PARALLEL_VALUES = 20000;
+SLICES_PER_WORKER = 4;
+pools = {};
+
+def get_pool(workers):
+    """Process pool of the given size, shared by every timeline loaded in this process"""
+    if workers not in pools:
+        #workers are started from a worker thread of the GUI, forking a process with threads can deadlock the children
+        pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'));
+    return pools[workers];
+
+class SharedStrings:
+    """Strings packed into one shared memory block as int64 end offsets followed by utf-8 text"""
+    def __init__(self, values):
+        encoded = [str(value).encode('utf-8', 'surrogatepass') for value in values];
+        ends = np.cumsum([len(value) for value in encoded], dtype=np.int64);
+        text = b''.join(encoded);
+        self.count = len(encoded);
+        self.block = shared_memory.SharedMemory(create=True, size=max(ends.nbytes + len(text), 1));
+        self.block.buf[:ends.nbytes] = ends.tobytes();
+        self.block.buf[ends.nbytes:ends.nbytes + len(text)] = text;
+
+    @property
+    def name(self):
+        return self.block.name;
+
+    def close(self):
+        self.block.close();
+        self.block.unlink();
+
+def attach(name, count, start, stop):
+    """Worker side: the strings start:stop of a SharedStrings block as a Series"""
+    block = shared_memory.SharedMemory(name=name);
+    try:
+        ends = np.frombuffer(block.buf, dtype=np.int64, count=count);
+        base = ends.nbytes;
+        first = int(ends[start - 1]) if start else 0;
+        text = bytes(block.buf[base + first:base + int(ends[stop - 1])]) if stop > start else b'';
+        bounds = ends[start:stop] - first;
+        del ends;
+    finally:
+        block.close();
+    starts = np.concatenate([[0], bounds[:-1]]) if len(bounds) else bounds;
+    return pd.Series([text[a:b].decode('utf-8', 'surrogatepass') for a, b in zip(starts, bounds)], dtype=object);
+
+def match_slice(name, count, start, stop, rules, applicable, prepass, share_costs):
+    """Worker: RuleSet.match_uniques of one slice of the unique values, with the seconds each rule took"""
+    seconds = np.zeros(len(rules));
+    rule_set = RuleSet(rules);
+    rule_set.share_costs = share_costs;
+    best, matched = rule_set.match_uniques(attach(name, count, start, stop), applicable, seconds, prepass);
+    return best, matched, seconds;
+
+def contains_slice(name, count, start, stop, term):
+    """Worker: which values of one slice contain the (lowercased, regex) search value"""
+    return attach(name, count, start, stop).str.contains(term, na=False, regex=True).to_numpy(dtype=bool);
+
+class Scanner:
+    """Matches the unique values of large columns in slices across scan_workers processes"""
+    def __init__(self, workers=1):
+        #0 means one process per CPU, 1 keeps matching in this process
+        self.workers = workers or os.cpu_count() or 1;
+
+    def worth(self, count):
+        """True when a column with count unique values is worth splitting"""
+        return self.workers > 1 and count >= MIN_PARALLEL_VALUES;
+
+    def run(self, values, work, *args):
+        """Results of work(name, count, start, stop, *args) for each slice of values, in order"""
+        strings = SharedStrings(values);
+        try:
+            slices = self.workers * SLICES_PER_WORKER;
+            bounds = np.linspace(0, len(values), slices + 1).astype(np.int64);
+            pool = get_pool(self.workers);
+            futures = [pool.submit(work, strings.name, strings.count, int(start), int(stop), *args) \
+                       for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start];
+            return [future.result() for future in futures];
+        finally:
+            strings.close();
+
+    def match_uniques(self, rules, uniques, applicable, seconds=None, prepass=True, share_costs=False):
+        """RuleSet.match_uniques with the per slice winners and masks joined back together,
+        the rule seconds of all workers add up, as processor time"""
+        parts = self.run(uniques, match_slice, rules, applicable, prepass, share_costs);
+        best = np.concatenate([part[0] for part in parts]);
+        matched = {i: np.concatenate([part[1][i] for part in parts]) for i in applicable};
+        if seconds is not None:
+            seconds += sum(part[2] for part in parts);
+        return best, matched;
+
+    def contains(self, uniques, term):
+        """Mask of the unique values containing the search value"""
+        return np.concatenate(self.run(uniques, contains_slice, term));
@@ -0,0 +1,440 @@
+"""
+Columnar storage for parsed timelines
+Each column is written as .npy files so later loads skip parsing the CSV, numbers, dates and category codes are memory mapped
+Timelines larger than memory are written as a series of such frames and read one chunk at a time
+"""
+import codecs
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from loader import concat_chunks
+from workers import no_progress
+
+#2: categories of chunked reads are sorted, entries written before are parsed again
+#3: text columns keep the offset of every value, so single rows are read without decoding the column
+FORMAT_VERSION = 3;
+MANIFEST = 'manifest.json';
+SAMPLE_BYTES = 1 << 20;
+CHUNK_DIR = 'k%d';
+#decoded chunks kept in memory, paging through a view mostly stays within one chunk
+LOADED_CHUNKS = 2;
+#rows of a chunk are read one at a time from the stored columns when fewer than 1/GATHER_SHARE of it are asked for
+GATHER_SHARE = 8;
+#out-of-core entries of files that changed or are gone are removed once unused for this long, another process may still read them
+STALE_SECONDS = 86400;
+
+def file_fingerprint(file_name, samples=8):
+    """Content hash of a file from evenly spaced 1MB samples, cheap even for very large files"""
+    size = os.path.getsize(file_name);
+    digest = hashlib.sha1(str(size).encode());
+    with open(file_name, 'rb') as source:
+        if size <= SAMPLE_BYTES * samples:
+            digest.update(source.read());
+        else:
+            step = (size - SAMPLE_BYTES) // (samples - 1);
+            for i in range(samples):
+                source.seek(i * step);
+                digest.update(source.read(SAMPLE_BYTES));
+    return digest.hexdigest();
+
+def source_files(file_name):
+    """List of the files of a cache entry, a merged timeline is given as a list of files"""
+    return [file_name] if isinstance(file_name, str) else list(file_name);
+
+def directory_size(directory):
+    """Total bytes of the files in a directory and its sub directories"""
+    return sum(os.path.getsize(os.path.join(path, name)) for path, _, names in os.walk(directory) for name in names);
+
+def save_frame(data, directory, extra=None):
+    """Write a DataFrame as one set of .npy files per column plus a manifest"""
+    os.makedirs(directory, exist_ok=True);
+    columns = [];
+    for i, col in enumerate(data.columns):
+        series = data[col];
+        prefix = os.path.join(directory, 'c%d' % i);
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            np.save(prefix + '.codes.npy', series.cat.codes.to_numpy());
+            categories = series.cat.categories;
+            if categories.dtype.kind in 'iufb':
+                np.save(prefix + '.categories.npy', categories.to_numpy());
+                kind = 'numeric-category';
+            else:
+                save_strings(prefix, pd.Series(categories.astype(str)));
+                kind = 'category';
+        elif isinstance(series.dtype, np.dtype) and series.dtype.kind in 'iufbmM':
+            np.save(prefix + '.npy', series.to_numpy());
+            kind = 'array';
+        elif series.dtype.kind in 'iu':
+            #nullable integers such as inode keep their values and a missing value mask
+            np.save(prefix + '.npy', series.to_numpy(dtype='int64', na_value=0));
+            np.save(prefix + '.missing.npy', series.isna().to_numpy());
+            kind = 'nullable-int';
+        elif save_strings(prefix, series):
+            kind = 'string';
+        else:
+            #text holding NUL characters cannot use the joined encoding
+            np.save(prefix + '.npy', series.to_numpy(dtype=object), allow_pickle=True);
+            kind = 'object';
+        columns.append({'name': str(col), 'kind': kind, 'dtype': str(series.dtype)});
+    manifest = {'version': FORMAT_VERSION, 'rows': len(data), 'columns': columns};
+    manifest.update(extra or {});
+    with open(os.path.join(directory, MANIFEST), 'w') as manifest_file:
+        json.dump(manifest, manifest_file);
+    return manifest;
+
+def save_strings(prefix, series):
+    """Store text as one NUL separated utf-8 buffer and a missing value mask, False if not possible"""
+    missing = series.isna().to_numpy();
+    values = series.to_numpy(dtype=object);
+    values = ['' if gone else str(value) for value, gone in zip(values, missing)];
+    text = '\x00'.join(values);
+    if text.count('\x00') != max(len(values) - 1, 0):
+        return False;
+    data = np.frombuffer(text.encode('utf-8', 'surrogatepass'), dtype=np.uint8);
+    np.save(prefix + '.text.npy', data);
+    np.save(prefix + '.missing.npy', missing);
+    #start of every value and one past the separator after the last one
+    offsets = np.concatenate([[0], np.flatnonzero(data == 0) + 1, [len(data) + 1]]).astype(np.int64);
+    np.save(prefix + '.offsets.npy', offsets[:len(values) + 1]);
+    return True;
+
+def load_strings(prefix, mmap_mode):
+    """Inverse of save_strings, text is decoded into python strings, it is not memory mapped"""
+    missing = np.load(prefix + '.missing.npy');
+    #decoded straight from the mapped buffer, without a bytes copy of the whole column first
+    text = codecs.utf_8_decode(np.load(prefix + '.text.npy', mmap_mode=mmap_mode), 'surrogatepass', True)[0];
+    values = np.empty(len(missing), dtype=object);
+    if len(missing):
+        values[:] = text.split('\x00');
+    values[missing] = np.nan;
+    return values;
+
+def load_string_rows(prefix, rows, mmap_mode):
+    """Values of some rows of a column stored by save_strings, only those values are read and decoded"""
+    missing = np.load(prefix + '.missing.npy', mmap_mode=mmap_mode)[rows];
+    text = np.load(prefix + '.text.npy', mmap_mode=mmap_mode);
+    offsets = np.load(prefix + '.offsets.npy', mmap_mode=mmap_mode);
+    values = np.empty(len(rows), dtype=object);
+    if len(rows) and rows.max() - rows.min() < 2 * len(rows):
+        #mostly consecutive rows, like a page of a view in file order, are decoded as one stretch
+        first, last = int(rows.min()), int(rows.max());
+        stretch = codecs.utf_8_decode(text[offsets[first]:offsets[last + 1] - 1], 'surrogatepass', True)[0];
+        values[:] = np.array(stretch.split('\x00'), dtype=object)[rows - first];
+    else:
+        values[:] = [codecs.utf_8_decode(text[start:stop - 1], 'surrogatepass', True)[0] \
+                     for start, stop in zip(offsets[rows].tolist(), offsets[rows + 1].tolist())];
+    values[missing] = np.nan;
+    return values;
+
+def save_chunks(chunks, directory, extra=None, progress=no_progress):
+    """Write a sequence of DataFrame chunks as one stored frame per chunk plus a manifest listing them"""
+    os.makedirs(directory, exist_ok=True);
+    sizes = [];
+    columns = None;
+    for chunk in chunks:
+        progress(sum(sizes), None, 'converting chunk %d' % (len(sizes) + 1));
+        save_frame(chunk, os.path.join(directory, CHUNK_DIR % len(sizes)));
+        sizes.append(len(chunk));
+        columns = columns or [{'name': str(col)} for col in chunk.columns];
+    if not sizes:
+        raise ValueError('no rows to store');
+    manifest = {'version': FORMAT_VERSION, 'rows': sum(sizes), 'columns': columns, 'chunks': sizes};
+    manifest.update(extra or {});
+    with open(os.path.join(directory, MANIFEST), 'w') as manifest_file:
+        json.dump(manifest, manifest_file);
+    return manifest;
+
+def take_rows(data, rows, columns=None):
+    """Rows of a DataFrame or of a ChunkedFrame by position"""
+    if isinstance(data, ChunkedFrame):
+        return data.take(rows, columns);
+    return (data if columns is None else data[columns]).iloc[rows];
+
+def read_manifest(directory):
+    """Manifest of a stored frame, None when missing or incomplete"""
+    try:
+        with open(os.path.join(directory, MANIFEST), 'r') as manifest_file:
+            manifest = json.load(manifest_file);
+    except (OSError, ValueError):
+        return None;
+    if manifest.get('version') != FORMAT_VERSION:
+        return None;
+    return manifest;
+
+def select(values, rows):
+    """values, or a copy of the given rows of them, reading only those rows of a memory mapped array"""
+    return values if rows is None else np.asarray(values[rows]);
+
+def load_frame(directory, mmap_mode='c', columns=None, rows=None):
+    """Open a stored frame, numeric columns and category codes stay memory mapped (copy on write), text is read into memory,
+    only the named columns and the rows at the given positions are read when they are given"""
+    manifest = read_manifest(directory);
+    if manifest is None:
+        return None;
+    if 'chunks' in manifest:
+        return ChunkedFrame(directory, manifest);
+    if rows is not None:
+        rows = np.asarray(rows, dtype=np.int64);
+    data = {};
+    for i, column in enumerate(manifest['columns']):
+        if columns is not None and column['name'] not in columns:
+            continue;
+        prefix = os.path.join(directory, 'c%d' % i);
+        kind = column['kind'];
+        if kind == 'array':
+            values = select(np.load(prefix + '.npy', mmap_mode=mmap_mode), rows);
+        elif kind == 'nullable-int':
+            mapped = None if rows is None else mmap_mode;
+            values = pd.arrays.IntegerArray(select(np.load(prefix + '.npy', mmap_mode=mapped), rows), \
+                                            select(np.load(prefix + '.missing.npy', mmap_mode=mapped), rows));
+        elif kind == 'string':
+            values = load_strings(prefix, mmap_mode) if rows is None else load_string_rows(prefix, rows, mmap_mode);
+        elif kind == 'object':
+            values = select(np.load(prefix + '.npy', allow_pickle=True), rows);
+        else:
+            codes = select(np.load(prefix + '.codes.npy', mmap_mode=mmap_mode), rows);
+            if kind == 'numeric-category':
+                categories = np.load(prefix + '.categories.npy');
+            else:
+                categories = load_strings(prefix, mmap_mode);
+            values = pd.Categorical.from_codes(codes, categories=categories);
+        data[column['name']] = values;
+    names = [column['name'] for column in manifest['columns']] if columns is None else [col for col in columns if col in data];
+    return pd.DataFrame(data, columns=names);
+
+class ChunkedFrame:
+    """Out-of-core timeline stored as chunks, only the chunks holding the rows asked for are loaded"""
+    def __init__(self, directory, manifest):
+        self.directory = directory;
+        self.columns = pd.Index([column['name'] for column in manifest['columns']]);
+        self.offsets = np.concatenate([[0], np.cumsum(manifest['chunks'])]).astype(np.int64);
+        self.loaded = OrderedDict();
+        #the UI thread pages through chunks while a worker thread filters them
+        self.lock = threading.Lock();
+
+    def __len__(self):
+        return int(self.offsets[-1]);
+
+    @property
+    def chunk_count(self):
+        return len(self.offsets) - 1;
+
+    def chunk(self, k, columns=None):
+        """DataFrame of chunk k with the given columns, all of them by default, positions are local to the chunk,
+        a column is decoded the first time it is asked for and kept with the chunk"""
+        names = list(self.columns) if columns is None else list(columns);
+        with self.lock:
+            frame = self.loaded.get(k);
+            if frame is not None:
+                self.loaded.move_to_end(k);
+        missing = names if frame is None else [col for col in names if col not in frame.columns];
+        if missing:
+            part = load_frame(os.path.join(self.directory, CHUNK_DIR % k), columns=missing);
+            frame = part if frame is None else pd.concat([frame, part], axis=1);
+            with self.lock:
+                self.loaded[k] = frame;
+                self.loaded.move_to_end(k);
+                while len(self.loaded) > LOADED_CHUNKS:
+                    self.loaded.popitem(last=False);
+        return frame[names];
+
+    def gather(self, k, local, columns=None):
+        """Rows of chunk k at local positions, read one by one from the stored columns
+        unless the chunk already has them decoded or most of it is asked for"""
+        names = list(self.columns) if columns is None else list(columns);
+        with self.lock:
+            frame = self.loaded.get(k);
+        decoded = frame is not None and all(col in frame.columns for col in names);
+        if decoded or len(local) * GATHER_SHARE >= self.offsets[k + 1] - self.offsets[k]:
+            return self.chunk(k, names).iloc[local];
+        return load_frame(os.path.join(self.directory, CHUNK_DIR % k), columns=names, rows=local);
+
+    def locate(self, rows):
+        """(chunk, local positions, where) per chunk holding any of rows, where places its results in rows"""
+        rows = np.asarray(rows, dtype=np.int64);
+        chunk_of = np.searchsorted(self.offsets, rows, side='right') - 1;
+        order = np.argsort(chunk_of, kind='stable');
+        bounds = np.searchsorted(chunk_of[order], np.arange(self.chunk_count + 1));
+        for k in range(self.chunk_count):
+            where = order[bounds[k]:bounds[k + 1]];
+            if len(where):
+                yield k, rows[where] - self.offsets[k], where;
+
+    def split(self, rows=None, columns=None):
+        """(chunk frame, local positions, where) per chunk holding any of rows, where places its results in rows,
+        without rows every chunk is given with local positions None and where a slice of the whole frame,
+        the frames have the given columns, all of them by default"""
+        if rows is None:
+            for k in range(self.chunk_count):
+                yield self.chunk(k, columns), None, slice(self.offsets[k], self.offsets[k + 1]);
+            return;
+        for k, local, where in self.locate(rows):
+            yield self.chunk(k, columns), local, where;
+
+    def take(self, rows, columns=None):
+        """DataFrame of the rows in the given order, indexed by their positions, only the given columns are read"""
+        rows = np.asarray(rows, dtype=np.int64);
+        parts = [];
+        positions = [];
+        for k, local, where in self.locate(rows):
+            parts.append(self.gather(k, local, columns));
+            positions.append(where);
+        if not parts:
+            return self.gather(0, rows, columns);
+        data = concat_chunks(parts);
+        data = data.iloc[np.argsort(np.concatenate(positions), kind='stable')];
+        data.index = pd.Index(rows);
+        return data;
+
+class MemoryChunks(ChunkedFrame):
+    """ChunkedFrame held in memory that rows can be appended to, for following a file that is still written"""
+    def __init__(self, chunks, chunk_rows):
+        self.frames = [];
+        self.chunk_rows = chunk_rows;
+        self.columns = chunks[0].columns;
+        self.offsets = np.zeros(1, dtype=np.int64);
+        self.lock = threading.Lock();
+        for chunk in chunks:
+            self.append(chunk);
+
+    def chunk(self, k, columns=None):
+        return self.frames[k] if columns is None else self.frames[k][list(columns)];
+
+    def gather(self, k, local, columns=None):
+        return self.chunk(k, columns).iloc[local];
+
+    def append(self, frame):
+        """Add rows at the end, small appends are gathered into the last chunk up to chunk_rows"""
+        frame = frame.reset_index(drop=True);
+        if self.frames and len(self.frames[-1]) + len(frame) <= self.chunk_rows:
+            self.frames[-1] = concat_chunks([self.frames[-1].copy(deep=False), frame]);
+        else:
+            self.frames.append(frame);
+        self.offsets = np.concatenate([[0], np.cumsum([len(chunk) for chunk in self.frames])]).astype(np.int64);
+
+class TimelineCache:
+    """On-disk cache of parsed timelines keyed by path, size, mtime and content hash, evicted least recently used first"""
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir;
+        self.max_bytes = max_bytes;
+
+    @property
+    def enabled(self):
+        return bool(self.cache_dir) and self.max_bytes > 0;
+
+    def key(self, file_name):
+        """Cache key of a source file, or of a list of files merged in that order"""
+        sources = [];
+        for name in source_files(file_name):
+            stat = os.stat(name);
+            sources.append('|'.join([os.path.abspath(name), str(stat.st_size), str(stat.st_mtime_ns), \
+                                     file_fingerprint(name)]));
+        return hashlib.sha1('\n'.join(sources).encode()).hexdigest();
+
+    def entry_dir(self, file_name):
+        """Cache directory of a file, where indexes are kept next to the data, None if it is not cached"""
+        if not self.enabled:
+            return None;
+        directory = os.path.join(self.cache_dir, self.key(file_name));
+        return directory if read_manifest(directory) is not None else None;
+
+    def load(self, file_name):
+        """Return the cached frame of a file, None on a miss"""
+        if not self.enabled:
+            return None;
+        directory = os.path.join(self.cache_dir, self.key(file_name));
+        try:
+            data = load_frame(directory);
+        except Exception as e:
+            print('Ignoring unreadable cache ', directory, e);
+            shutil.rmtree(directory, ignore_errors=True);
+            return None;
+        if data is not None:
+            #the manifest mtime records the last use for eviction
+            os.utime(os.path.join(directory, MANIFEST));
+        return data;
+
+    def store(self, file_name, data):
+        """Write the frame of a file to the cache and evict old entries over the size cap"""
+        if not self.enabled:
+            return;
+        key = self.key(file_name);
+        directory = os.path.join(self.cache_dir, key);
+        staging = directory + '.tmp%d' % os.getpid();
+        try:
+            shutil.rmtree(staging, ignore_errors=True);
+            save_frame(data, staging, {'source': [os.path.abspath(name) for name in source_files(file_name)], \
+                                       'created': time.time()});
+            shutil.rmtree(directory, ignore_errors=True);
+            os.rename(staging, directory);
+        except Exception as e:
+            print('Could not cache ', file_name, e);
+            shutil.rmtree(staging, ignore_errors=True);
+            return;
+        self.evict(keep=key);
+
+    def store_chunks(self, file_name, chunks, progress=no_progress):
+        """Convert the chunks of a file into an out-of-core cache entry and return it as a ChunkedFrame"""
+        key = self.key(file_name);
+        directory = os.path.join(self.cache_dir, key);
+        staging = directory + '.tmp%d' % os.getpid();
+        try:
+            shutil.rmtree(staging, ignore_errors=True);
+            save_chunks(chunks, staging, {'source': [os.path.abspath(name) for name in source_files(file_name)], \
+                                          'created': time.time()}, progress);
+            shutil.rmtree(directory, ignore_errors=True);
+            os.rename(staging, directory);
+        except BaseException:
+            #unlike a cached copy the chunks are the only copy of the data, so failures are not ignored
+            shutil.rmtree(staging, ignore_errors=True);
+            raise;
+        self.evict(keep=key);
+        return load_frame(directory);
+
+    def entries(self):
+        """(last used, bytes, directory) of every complete cache entry"""
+        entries = [];
+        if not os.path.isdir(self.cache_dir):
+            return entries;
+        for entry in os.scandir(self.cache_dir):
+            manifest = os.path.join(entry.path, MANIFEST);
+            if entry.is_dir() and os.path.exists(manifest):
+                entries.append((os.path.getmtime(manifest), directory_size(entry.path), entry.path));
+        return entries;
+
+    def stale(self, directory, manifest):
+        """True when the source files of an entry changed or are gone"""
+        try:
+            return self.key(manifest.get('source', [])) != os.path.basename(directory);
+        except OSError:
+            return True;
+
+    def evict(self, keep=None):
+        """Remove least recently used cached copies until they fit in max_bytes,
+        out-of-core entries are the only copy of their data, they are not counted and only removed when stale"""
+        entries = [];
+        for used, size, directory in sorted(self.entries()):
+            manifest = read_manifest(directory);
+            if manifest is None or 'chunks' not in manifest:
+                entries.append((used, size, directory));
+            elif os.path.basename(directory) != keep and time.time() - used > STALE_SECONDS and self.stale(directory, manifest):
+                shutil.rmtree(directory, ignore_errors=True);
+        kept = sum(size for _, size, directory in entries if os.path.basename(directory) == keep);
+        if kept > self.max_bytes:
+            print('The cached copy in ', os.path.join(self.cache_dir, keep), ' alone is larger than cache_size_mb, ', \
+                  'other entries are kept, raise cache_size_mb to keep several');
+            return;
+        total = sum(size for _, size, _ in entries);
+        for _, size, directory in entries:
+            if total <= self.max_bytes:
+                break;
+            if os.path.basename(directory) == keep:
+                continue;
+            shutil.rmtree(directory, ignore_errors=True);
+            total -= size;
@@ -0,0 +1,30 @@
+"""
+Tests of the highlight rule engine
+Run with python -m pytest from the repository folder
+"""
+import os
+import sys
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)));
+sys.path.insert(0, ROOT);
+from highlighter import load_rules, RuleSet
+
+def test_bundled_rules_on_arrow_strings():
+    """The bundled rules, EQUALS and ENDS among them, run on Arrow string columns as installed with pyarrow"""
+    pytest.importorskip('pyarrow');
+    rules = load_rules(os.path.join(ROOT, 'highlights.txt'));
+    values = ['LNK', 'C:/Users/a/Recent/report.lnk', 'Visited: file:///c:/x (Chrome)', 'plain row'] * 3;
+    data = pd.DataFrame({col: pd.Series(values, dtype='string[pyarrow]') \
+                         for col in dict.fromkeys(rule.column for rule in rules.rules) if col != '*'});
+    result = rules.evaluate(data);
+    assert len(result.rows()) > 0;
+
+def test_rules_that_do_not_combine():
+    """Global flags, groups and backreferences are matched on their own, as each rule alone would"""
+    rules = RuleSet.parse(['short=CONTAINS=(?i)usb=#FF0000', 'short=CONTAINS=(x)y=#00FF00', 'short=CONTAINS=(a)\\1=#0000FF', \
+                           'short=CONTAINS=disk=#FFFF00']);
+    data = pd.DataFrame({'short': ['USB stick', 'xy', 'aa', 'disk', 'other'] * 3});
+    result = rules.evaluate(data);
+    assert list(result.hits) == [3, 3, 3, 3];
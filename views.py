@@ -0,0 +1,87 @@
+"""
+Table views over the loaded timeline
+A view is an index vector into the shared data, rows are only materialized one window at a time
+"""
+import numpy as np
+import pandas as pd
+from storage import ChunkedFrame, take_rows
+
+class TableView:
+    """Rows of a frame selected and ordered by an index vector, with a compact color code and rule per row"""
+    def __init__(self, data, rows, color_codes=None, palette=(), labels=None, rule_index=None, rule_names=()):
+        self.data = data;
+        self.rows = np.asarray(rows, dtype=np.int64);
+        self.color_codes = np.full(len(self.rows), -1, dtype=np.int16) if color_codes is None else color_codes;
+        self.palette = list(palette);
+        #labels, when set, are shown in an 'index' column like reset_index(drop=False) did
+        self.labels = labels;
+        #winning highlight rule of each row, -1 where none matched
+        self.rule_index = np.full(len(self.rows), -1, dtype=np.int32) if rule_index is None else rule_index;
+        self.rule_names = list(rule_names);
+
+    def __len__(self):
+        return len(self.rows);
+
+    def window(self, start, stop):
+        """DataFrame of the rows start:stop of the view, indexed by their view position"""
+        window = take_rows(self.data, self.rows[start:stop]);
+        window.index = pd.RangeIndex(start, start + len(window));
+        if self.labels is not None:
+            window.insert(0, 'index', self.labels[start:stop]);
+        return window;
+
+    def frame(self):
+        """Whole view as a DataFrame, for saving"""
+        return take_rows(self.data, self.rows).reset_index(drop=True);
+
+    def take(self, positions):
+        """Sub view of the given view positions, labelled with those positions as the reduced view is"""
+        positions = np.asarray(positions, dtype=np.int64);
+        return TableView(self.data, self.rows[positions], self.color_codes[positions], self.palette, positions, \
+                         self.rule_index[positions], self.rule_names);
+
+    def snapshot(self):
+        """View sharing the current arrays, so sorting or appending to this one while it is saved does not affect it"""
+        return TableView(self.data, self.rows, self.color_codes, self.palette, self.labels, self.rule_index, self.rule_names);
+
+    def extend(self, rows, color_codes=None, labels=None, rule_index=None):
+        """Append rows at the end of the view, as when a followed file grows"""
+        rows = np.asarray(rows, dtype=np.int64);
+        self.rows = np.concatenate([self.rows, rows]);
+        if color_codes is None:
+            color_codes = np.full(len(rows), -1, dtype=np.int16);
+        self.color_codes = np.concatenate([self.color_codes, color_codes]);
+        if rule_index is None:
+            rule_index = np.full(len(rows), -1, dtype=np.int32);
+        self.rule_index = np.concatenate([self.rule_index, rule_index]);
+        if self.labels is not None:
+            self.labels = np.concatenate([self.labels, labels]);
+
+    def column(self, col):
+        """Values of one column for the rows of the view, in view order"""
+        if col == 'index' and self.labels is not None:
+            return pd.Series(self.labels);
+        if isinstance(self.data, ChunkedFrame):
+            return take_rows(self.data, self.rows, [col])[col].reset_index(drop=True);
+        if len(self.rows) == len(self.data) and np.array_equal(self.rows, np.arange(len(self.data))):
+            return self.data[col].reset_index(drop=True);
+        return self.data[col].iloc[self.rows].reset_index(drop=True);
+
+    def sort(self, col, ascending=True):
+        """Sort by permuting the index vector, the data itself is not touched"""
+        order = self.column(col).sort_values(ascending=ascending, kind='mergesort', na_position='last').index.to_numpy();
+        self.rows = self.rows[order];
+        self.color_codes = self.color_codes[order];
+        self.rule_index = self.rule_index[order];
+        if self.labels is not None:
+            self.labels = self.labels[order];
+
+    def window_colors(self, start, stop):
+        """Color of each row start:stop of the view, None where the row is not highlighted"""
+        palette = np.array(self.palette + [None], dtype=object);
+        return palette[self.color_codes[start:stop]];
+
+    def window_rules(self, start, stop):
+        """Highlight rule of each row start:stop of the view, None where the row is not highlighted"""
+        names = np.array(self.rule_names + [None], dtype=object);
+        return names[self.rule_index[start:stop]];
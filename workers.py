@@ -0,0 +1,62 @@
+"""
+Background execution for long running operations
+Work runs on a worker thread and reports progress and its result through a queue polled by the UI
+"""
+import queue
+import threading
+import traceback
+
+class Cancelled(Exception):
+    """Raised inside a task when the user pressed Cancel"""
+
+class Task:
+    """Runs work(progress, *args) on a worker thread, messages are ('progress'|'done'|'error'|'cancelled', value)"""
+    def __init__(self, work, *args):
+        self.work = work;
+        self.args = args;
+        self.messages = queue.Queue();
+        self.cancel_event = threading.Event();
+        self.thread = threading.Thread(target=self.run, daemon=True);
+        self.finished = False;
+
+    def start(self):
+        self.thread.start();
+        return self;
+
+    def run(self):
+        """Worker thread body"""
+        try:
+            result = self.work(self.progress, *self.args);
+        except Cancelled:
+            self.messages.put(('cancelled', None));
+        except Exception as e:
+            traceback.print_exc();
+            self.messages.put(('error', e));
+        else:
+            self.messages.put(('done', result));
+
+    def progress(self, done, total=None, message=''):
+        """Called by the work with its progress, raises Cancelled once cancel was requested"""
+        if self.cancel_event.is_set():
+            raise Cancelled();
+        self.messages.put(('progress', (done, total, message)));
+
+    def cancel(self):
+        self.cancel_event.set();
+
+    def poll(self):
+        """All messages queued since the last poll, to be called from the UI thread"""
+        messages = [];
+        while True:
+            try:
+                message = self.messages.get_nowait();
+            except queue.Empty:
+                break;
+            if message[0] != 'progress':
+                self.finished = True;
+            messages.append(message);
+        return messages;
+
+def no_progress(done, total=None, message=''):
+    """Progress callback for callers that do not report progress"""
+    return;